@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import platform
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orm import connection
+from orm.model import *
+from orm.query import Select, ExprList, ModelList, statement_cache
+
+
+class Author(Model):
+    _orm_table = 'author'
+    name = Column()
+    country = Column(index=True)
+
+
+class Book(Model):
+    _orm_table = 'book'
+    title = Column()
+    year = Column(type='integer')
+    author_id = Column('author', index=True)
+    author = ToOne(author_id, 'Author.pk')
+
+
+Author.books = ToMany(Author.pk, Book.author_id)
+
+
+class Document(Model):
+    _orm_table = 'document'
+    title = Column()
+    body = Column(group='text')
+    summary = Column(group='text')
+
+
+class Scratch(Model):
+    _orm_table = 'scratch'
+    name = Column()
+    value = Column()
+
+
+COUNTRIES = ['nz', 'uk', 'us', 'de', 'fr', 'jp', 'br', 'in']
+CASES = []
+
+
+def case(fn):
+    CASES.append(fn)
+    return fn
+
+
+def seed(rows, rng):
+    for model in (Author, Book, Document, Scratch):
+        model.create_table()
+        model.create_indexes()
+    Author.insert_many(dict(name='author %d' % i, country=rng.choice(COUNTRIES))
+                       for i in xrange(rows // 10))
+    Book.insert_many(dict(title='book %d' % i, year=rng.randint(1900, 2000),
+                          author_id=rng.randint(1, rows // 10))
+                     for i in xrange(rows))
+    Document.insert_many(dict(title='doc %d' % i, body='x' * 2000,
+                              summary='y' * 200)
+                         for i in xrange(rows // 10))
+    connection.commit()
+
+
+def forget(*models):
+    for model in models:
+        model._orm_obj_cache.clear()
+        if model._orm_lru is not None:
+            model._orm_lru.clear()
+
+
+def scratch(i):
+    obj = Scratch()
+    obj.name = 's%d' % i
+    obj.value = i
+    return obj
+
+
+@case
+def save(rows):
+    def run():
+        for i in xrange(rows // 10):
+            scratch(i).save()
+        connection.commit()
+    return run, rows // 10
+
+
+@case
+def save_many(rows):
+    def run():
+        Scratch.save_many([scratch(i) for i in xrange(rows // 10)])
+        connection.commit()
+    return run, rows // 10
+
+
+@case
+def find_iterate(rows):
+    def run():
+        forget(Book)
+        for book in Book.find():
+            pass
+    return run, rows
+
+
+@case
+def find_filtered(rows):
+    def run():
+        for country in COUNTRIES:
+            list(Author.find(Author.country == country))
+    return run, len(COUNTRIES)
+
+
+@case
+def to_one(rows):
+    books = list(Book.find()[:rows // 10])
+    def run():
+        forget(Author)
+        for book in books:
+            book.author
+    return run, len(books)
+
+
+@case
+def to_many(rows):
+    authors = list(Author.find()[:rows // 100 or 1])
+    def run():
+        for author in authors:
+            list(author.books)
+    return run, len(authors)
+
+
+@case
+def lazy_column(rows):
+    docs = list(Document.find()[:rows // 100 or 1])
+    def run():
+        for doc in docs:
+            doc.__dict__.pop('body', None)
+            doc.__dict__.pop('summary', None)
+            doc.body
+    return run, len(docs)
+
+
+@case
+def sql_compile(rows):
+    q = Book.find(Book.year > 1950, Book.author_id.is_in([1, 2, 3]))
+    q = q.order_by(Book.year, Book.title)[10:20]
+    def run():
+        for i in xrange(100):
+            statement_cache.compile(q)
+    return run, 100
+
+
+@case
+def get_compile(rows):
+    what = ExprList(Book._orm_column_objects())
+    def run():
+        for i in xrange(100):
+            statement_cache.compile(Select(what, ModelList([Book]),
+                                           Book.pk == i))
+    return run, 100
+
+
+@case
+def count(rows):
+    q = Book.find(Book.year > 1950)
+    def run():
+        for i in xrange(10):
+            len(q)
+    return run, 10
+
+
+@case
+def exists(rows):
+    q = Book.find(Book.year > 1950)
+    def run():
+        for i in xrange(100):
+            q.exists()
+    return run, 100
+
+
+def measure(fn, rows, repeat):
+    run, ops = fn(rows)
+    run()
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+    timings.sort()
+    return dict(ops=ops, repeat=repeat,
+                best_us=timings[0] / ops * 1e6,
+                median_us=timings[len(timings) // 2] / ops * 1e6)
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print '%-16s %12s %12s %8s' % ('case', 'before us', 'after us', 'change')
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result['best_us'] / before['best_us'] - 1
+        flag = ''
+        if change > threshold:
+            flag = ' !'
+            regressions.append(name)
+        print '%-16s %12.2f %12.2f %+7.1f%%%s' % (
+            name, before['best_us'], result['best_us'], change * 100, flag)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the orm hot paths.')
+    parser.add_argument('-n', '--rows', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('-c', '--compare', help='JSON results to compare to')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='fail when a case slows down by this fraction')
+    parser.add_argument('cases', nargs='*', help='run only these cases')
+    args = parser.parse_args(argv)
+
+    cases = [fn for fn in CASES if not args.cases or fn.__name__ in args.cases]
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        connection.connect(path)
+        seed(args.rows, random.Random(args.seed))
+        results = {}
+        for fn in cases:
+            results[fn.__name__] = measure(fn, args.rows, args.repeat)
+            print >>sys.stderr, '%-16s %10.2f us/op' % (
+                fn.__name__, results[fn.__name__]['best_us'])
+    finally:
+        connection.close()
+        os.unlink(path)
+
+    report = dict(
+        meta=dict(time=time.time(), rows=args.rows, repeat=args.repeat,
+                  seed=args.seed, python=platform.python_version(),
+                  sqlite=sqlite3.sqlite_version),
+        results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+from orm.connection import transaction, savepoint
@@ -0,0 +1,70 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=128, ttl=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return float(self.hits) / total
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, stamp = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None and time.time() - stamp > self.ttl:
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._items[key] = (value, stamp)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time())
+            while len(self._items) > self.maxsize:
+                evicted, (value, stamp) = self._items.popitem(last=False)
+                self._evicted(evicted, value)
+                self.evictions += 1
+
+    def _evicted(self, key, value):
+        pass
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
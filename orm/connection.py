@@ -1,19 +1,231 @@
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
 
 
 connection = None
+pool = None
+read_pool = None
 
+_state = threading.local()
+_group_commit = None
+_grouped = {}
+_attached = ()
+_execute_hooks = ()
+_rows_hooks = ()
+_end_hooks = ()
 
-def connect(database, timeout=None, isolation_level=None, detect_types=None):
-    global connection
+
+PROFILES = {
+    'read-heavy': dict(cached_statements=512, pragmas=[
+        ('journal_mode', 'wal'),
+        ('synchronous', 'normal'),
+        ('mmap_size', 268435456),
+        ('cache_size', -65536),
+        ('temp_store', 'memory'),
+    ]),
+    'bulk-load': dict(cached_statements=256, pragmas=[
+        ('journal_mode', 'wal'),
+        ('synchronous', 'off'),
+        ('mmap_size', 268435456),
+        ('cache_size', -262144),
+        ('temp_store', 'memory'),
+    ]),
+    'durable': dict(cached_statements=128, pragmas=[
+        ('journal_mode', 'wal'),
+        ('synchronous', 'full'),
+        ('mmap_size', 0),
+        ('cache_size', -16384),
+        ('temp_store', 'default'),
+    ]),
+}
+
+
+def _profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError('unknown profile: %r' % (name,))
+
+
+class _Lease(object):
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def release(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool.checkin(connection)
+
+    def __del__(self):
+        self.release()
+
+
+class Pool(object):
+    def __init__(self, factory, size=5, pragmas=None, timeout=None):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        if pragmas is None:
+            pragmas = ()
+        elif hasattr(pragmas, 'items'):
+            pragmas = pragmas.items()
+        self.factory = factory
+        self.size = size
+        self.pragmas = tuple(pragmas)
+        self.timeout = timeout
+        self.checkouts = 0
+        self.waits = 0
+        self.opened = 0
+        self._idle = []
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def stats(self):
+        return dict(size=self.size, opened=self.opened, idle=self.idle,
+                    checkouts=self.checkouts, waits=self.waits)
+
+    def _open(self):
+        connection = self.factory()
+        for name, value in self.pragmas:
+            connection.execute('pragma %s = %s' % (name, value))
+        return connection
+
+    def checkout(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self._cond:
+            self.checkouts += 1
+            if not self._idle and self.opened >= self.size:
+                self.waits += 1
+                deadline = None if timeout is None else time.time() + timeout
+                while not self._idle and self.opened >= self.size:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(
+                            'timed out waiting for a connection; all %d are '
+                            'leased (threads must call connection.release() '
+                            'when done)' % (self.size,))
+                    self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self.opened += 1
+        try:
+            return self._open()
+        except:
+            with self._cond:
+                self.opened -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, connection):
+        try:
+            connection.rollback()
+        except sqlite3.Error:
+            _grouped.pop(connection, None)
+            with self._cond:
+                self.opened -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(connection)
+            self._cond.notify()
+
+    def connection(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            lease = self._local.lease = _Lease(self, self.checkout())
+        return lease.connection
+
+    def leased(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            return lease.connection
+
+    def release(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            del self._local.lease
+            lease.release()
+
+    def close(self):
+        self.release()
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.opened -= len(idle)
+        for connection in idle:
+            _grouped.pop(connection, None)
+            connection.close()
+
+
+def open_pool(database, timeout=None, isolation_level=None, detect_types=None,
+              pool_size=5, pragmas=None, profile=None, cached_statements=None,
+              pool_timeout=30):
     if detect_types is None:
         detect_types = sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-    kw = dict(detect_types=detect_types)
+    if profile is not None:
+        tuned = _profile(profile)
+        if pragmas is not None:
+            if hasattr(pragmas, 'items'):
+                pragmas = pragmas.items()
+            pragmas = OrderedDict(tuned['pragmas'] + list(pragmas)).items()
+        else:
+            pragmas = tuned['pragmas']
+        if cached_statements is None:
+            cached_statements = tuned['cached_statements']
+    kw = dict(detect_types=detect_types, check_same_thread=False)
     if timeout is not None:
         kw['timeout'] = timeout
+    if cached_statements is not None:
+        kw['cached_statements'] = cached_statements
     if isolation_level is not None:
         kw['isolation_level'] = isolation_level
-    connection = sqlite3.connect(database, **kw)
+    return Pool(lambda: sqlite3.connect(database, **kw), pool_size, pragmas,
+                pool_timeout)
+
+
+def connect(database, timeout=None, isolation_level=None, detect_types=None,
+            pool_size=5, pragmas=None, profile=None, cached_statements=None,
+            read_pool_size=0, pool_timeout=30):
+    global connection, pool, read_pool
+    if database == ':memory:':
+        pool_size = 1
+        read_pool_size = 0
+    close()
+    if read_pool_size:
+        pool_size = 1
+    pool = open_pool(database, timeout, isolation_level, detect_types,
+                     pool_size, pragmas, profile, cached_statements,
+                     pool_timeout)
+    if read_pool_size:
+        journal = dict(pool.pragmas).get('journal_mode', 'wal')
+        if str(journal).lower() != 'wal':
+            pool = None
+            raise ValueError('a read pool requires journal_mode=wal')
+        if 'journal_mode' not in dict(pool.pragmas):
+            pool.pragmas += (('journal_mode', 'wal'),)
+        read_pool = Pool(pool.factory, read_pool_size,
+                         pool.pragmas + (('query_only', 1),), pool_timeout)
+
+
+def close():
+    global connection, pool, read_pool
+    connection = None
+    if pool is not None:
+        pool.close()
+        pool = None
+    if read_pool is not None:
+        read_pool.close()
+        read_pool = None
 
 
 class printing_cursor(object):
@@ -30,16 +242,318 @@ class printing_cursor(object):
         return self.cursor.execute(sql, *args)
 
 
-def cursor():
-    global connection
-    if connection is None:
+class profiling_cursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self._sql = None
+        self._rows = 0
+
+    def __getattr__(self, name):
+        if name == 'cursor':
+            return super(profiling_cursor, self).__getattr__(name)
+        return getattr(self.cursor, name)
+
+    def _run(self, method, sql, args):
+        self._done()
+        start = time.time()
+        method(sql, args)
+        elapsed = time.time() - start
+        for hook in _execute_hooks:
+            hook(sql, args, elapsed)
+        self._sql, self._rows = sql, 0
+        if self.cursor.description is None:
+            self._rows = max(self.cursor.rowcount, 0)
+            self._done()
+        return self
+
+    def _done(self):
+        sql, self._sql = self._sql, None
+        if sql is not None:
+            for hook in _rows_hooks:
+                hook(sql, self._rows)
+
+    def execute(self, sql, args=()):
+        return self._run(self.cursor.execute, sql, args)
+
+    def executemany(self, sql, args):
+        return self._run(self.cursor.executemany, sql, args)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            row = self.cursor.next()
+        except StopIteration:
+            self._done()
+            raise
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            self._done()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.cursor.arraysize
+        rows = self.cursor.fetchmany(size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._done()
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self._rows += len(rows)
+        self._done()
+        return rows
+
+    def close(self):
+        self._done()
+        self.cursor.close()
+
+    def __del__(self):
+        self._done()
+
+
+def on_execute(hook):
+    global _execute_hooks
+    _execute_hooks += (hook,)
+    return hook
+
+
+def on_rows(hook):
+    global _rows_hooks
+    _rows_hooks += (hook,)
+    return hook
+
+
+def on_end(hook):
+    global _end_hooks
+    _end_hooks += (hook,)
+    return hook
+
+
+def remove_hook(hook):
+    global _execute_hooks, _rows_hooks, _end_hooks
+    _execute_hooks = tuple(h for h in _execute_hooks if h != hook)
+    _rows_hooks = tuple(h for h in _rows_hooks if h != hook)
+    _end_hooks = tuple(h for h in _end_hooks if h != hook)
+
+
+def _ended():
+    for hook in _end_hooks:
+        hook()
+
+
+@contextmanager
+def using(conn):
+    previous = getattr(_state, 'connection', None)
+    _state.connection = conn
+    try:
+        yield conn
+    finally:
+        _state.connection = previous
+
+
+def _current():
+    conn = getattr(_state, 'connection', None)
+    if conn is not None:
+        return conn
+    if connection is not None:
+        return connection
+    if pool is None:
         raise RuntimeError('not connected')
-    #return printing_cursor(connection.cursor())
-    return connection.cursor()
+    return pool.connection()
+
+
+def cursor(readonly=False):
+    if readonly and read_pool is not None and connection is None and \
+       getattr(_state, 'connection', None) is None and \
+       not _depth() and not getattr(_state, 'writes', False):
+        conn = read_pool.connection()
+    else:
+        conn = _current()
+        if not readonly:
+            _state.writes = True
+    if _execute_hooks or _rows_hooks:
+        return profiling_cursor(conn.cursor())
+    return conn.cursor()
+
+
+def _depth():
+    return getattr(_state, 'depth', 0)
+
+
+def _unsynced(conn):
+    state = _grouped.pop(conn, None)
+    if state is not None:
+        conn.execute('pragma synchronous = %d' % (state[1],))
+
+
+def _synced(conn):
+    if _group_commit is None:
+        _unsynced(conn)
+        return
+    state = _grouped.get(conn, False)
+    if state is False:
+        state = None
+        if conn.execute('pragma journal_mode').fetchone()[0] == 'wal':
+            level = conn.execute('pragma synchronous').fetchone()[0]
+            state = [0, level]
+        _grouped[conn] = state
+    if state is None:
+        return
+    state[0] += 1
+    if (state[0] + 1) % _group_commit:
+        level = min(state[1], 1)
+    else:
+        level = state[1]
+    conn.execute('pragma synchronous = %d' % (level,))
+
+
+def attach(other):
+    global _attached
+    _attached += (other,)
+
+
+def detach(other):
+    global _attached
+    _attached = tuple(p for p in _attached if p is not other)
+
+
+def _connections():
+    conns = []
+    if connection is not None or pool is not None or \
+       getattr(_state, 'connection', None) is not None or not _attached:
+        conns.append(_current())
+    for other in _attached:
+        conn = other.leased()
+        if conn is not None and conn not in conns:
+            conns.append(conn)
+    return conns
 
 
 def commit():
-    global connection
-    if connection is None:
-        raise RuntimeError('not connected')
-    connection.commit()
+    if _depth():
+        return
+    for conn in _connections():
+        conn.commit()
+        _synced(conn)
+    _state.writes = False
+    _ended()
+
+
+def rollback():
+    if _depth():
+        raise RuntimeError('cannot roll back inside a transaction scope; '
+                           'raise an exception instead')
+    for conn in _connections():
+        conn.rollback()
+    _state.writes = False
+    _ended()
+
+
+def group_commit(max_commits=None):
+    global _group_commit
+    if max_commits is not None and max_commits < 1:
+        raise ValueError('max_commits must be at least 1')
+    _group_commit = max_commits
+
+
+def release():
+    for other in (pool, read_pool) + _attached:
+        if other is not None:
+            other.release()
+
+
+@contextmanager
+def _scope(begin, end):
+    conn = _current()
+    depth = _depth()
+    if depth:
+        name = 'orm_%d' % (depth,)
+        conn.execute('savepoint ' + name)
+    else:
+        level = conn.isolation_level
+        conn.isolation_level = None
+        conn.execute(begin)
+    _state.depth = depth + 1
+    try:
+        yield conn
+    except:
+        _state.depth = depth
+        if depth:
+            conn.execute('rollback to ' + name)
+            conn.execute('release ' + name)
+        else:
+            try:
+                conn.execute('rollback')
+            finally:
+                conn.isolation_level = level
+                _state.writes = False
+                _ended()
+        raise
+    else:
+        _state.depth = depth
+        if depth:
+            conn.execute('release ' + name)
+        else:
+            try:
+                conn.execute(end)
+            except:
+                conn.execute('rollback')
+                raise
+            finally:
+                conn.isolation_level = level
+                _state.writes = False
+                _ended()
+            _synced(conn)
+
+
+def transaction():
+    return _scope('begin', 'commit')
+
+
+@contextmanager
+def atomic():
+    conn = _current()
+    if _depth() or getattr(conn, 'isolation_level', None) is not None:
+        yield conn
+    else:
+        with transaction() as conn:
+            yield conn
+
+
+def savepoint():
+    return _scope('savepoint orm_0', 'release orm_0')
+
+
+@contextmanager
+def tuning(profile):
+    conn = _current()
+    previous = []
+    for name, value in _profile(profile)['pragmas']:
+        row = conn.execute('pragma %s' % (name,)).fetchone()
+        if row is not None:
+            previous.append((name, row[0]))
+    commit()
+    _unsynced(conn)
+    for name, value in _profile(profile)['pragmas']:
+        conn.execute('pragma %s = %s' % (name, value))
+    try:
+        yield conn
+    finally:
+        commit()
+        _unsynced(conn)
+        for name, value in previous:
+            conn.execute('pragma %s = %s' % (name, value))
+
+
+def bulk_load():
+    return tuning('bulk-load')
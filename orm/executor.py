@@ -0,0 +1,129 @@
+import sys
+import threading
+import Queue
+
+from orm import connection
+
+
+__all__ = ['Future', 'Executor', 'default_executor', 'submit', 'in_worker']
+
+
+_worker = threading.local()
+
+
+class Future(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise RuntimeError('timed out waiting for result')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise RuntimeError('timed out waiting for result')
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, result=None, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class Executor(object):
+    def __init__(self, workers=4):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _start(self):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('executor has been shut down')
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        _worker.active = True
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            result = exc_info = None
+            try:
+                result = fn(*args, **kwargs)
+            except:
+                exc_info = sys.exc_info()
+            try:
+                connection.release()
+            except:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+            finally:
+                future._finish(result, exc_info)
+
+    def submit(self, fn, *args, **kwargs):
+        self._start()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_executor():
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Executor()
+        return _default
+
+
+def submit(fn, *args, **kwargs):
+    return default_executor().submit(fn, *args, **kwargs)
+
+
+def in_worker():
+    return getattr(_worker, 'active', False)
@@ -1,26 +1,41 @@
+import itertools
 from weakref import WeakValueDictionary
+from collections import OrderedDict
 
 from orm import connection
+from orm.cache import LRUCache
+from orm.executor import submit
 from orm.query import *
+from orm.query import _IN_BATCH_SIZE, _tables, _version
 
 
 _REGISTERED = {}
+_MISSING = object()
+_COUNTER = itertools.count()
 
 
-__all__ = 'Column SqlColumn ToOne ToMany ManyToMany Model'.split()
+__all__ = 'Column SqlColumn ToOne ToMany ManyToMany Index Model'.split()
 
 
 class Column(Expr):
-    def __init__(self, name=None, primary=False, converter=None, adapter=None):
+    def __init__(self, name=None, primary=False, converter=None, adapter=None,
+                 group=None, index=False, unique=False, type=None):
         self.name = name
         self.primary = primary
         if converter is not None:
             self.converter = converter
         if adapter is not None:
             self.adapter = adapter
+        if group is not None:
+            self.group = group
+        self.index = index
+        self.unique = unique
+        self.type = type
+        self._order = next(_COUNTER)
 
     converter = None
     adapter = None
+    group = None
 
     def __get__(self, obj, cls):
         if not hasattr(self, 'model'):
@@ -32,8 +47,21 @@ class Column(Expr):
         return obj._orm_load_column(self)
 
     def _bind(self, model):
-        return BoundColumn(model, self.name, self.primary,
-                           self.converter, self.adapter)
+        bound = BoundColumn(model, self.name, self.primary,
+                            self.converter, self.adapter, self.group,
+                            self.index, self.unique, self.type)
+        bound._order = self._order
+        return bound
+
+    def _definition(self):
+        definition = self.name
+        if self.type is not None:
+            definition += ' ' + self.type
+        if self.primary and 'primary key' not in definition.lower():
+            if ' ' not in definition:
+                definition += ' integer'
+            definition += ' primary key'
+        return definition
 
     def sql(self):
         if hasattr(self, 'model'):
@@ -77,6 +105,8 @@ class BoundSqlColumn(SqlColumn):
 
 
 class Reference(object):
+    _orm_many = True
+
     def __init__(self, my_column, other_column):
         self.my_column = my_column
         self.other_column = other_column
@@ -96,8 +126,19 @@ class Reference(object):
         if isinstance(self.other_column, basestring):
             self.other_column = self._column_by_name(self.other_column)
 
+    def _orm_prefetched(self, obj, value, default=None):
+        try:
+            key, prefetched = obj._orm_related[self]
+        except KeyError:
+            return default
+        if key != value:
+            return default
+        return prefetched
+
 
 class ToOne(Reference, Expr):
+    _orm_many = False
+
     def __get__(self, obj, cls):
         self._promote_by_name()
         if obj is None:
@@ -105,8 +146,16 @@ class ToOne(Reference, Expr):
         value = obj._orm_get_column(self.my_column)
         if value is None:
             return None
+        other = self._orm_prefetched(obj, value, _MISSING)
+        if other is not _MISSING:
+            return other
+        model = self.other_column.model
+        if self.other_column.primary:
+            other = model._orm_cached(value)
+            if other is not None:
+                return other
         try:
-            return self.other_column.model.find(self.other_column == value)[0]
+            return model.find(self.other_column == value)[0]
         except IndexError:
             return None
 
@@ -114,17 +163,45 @@ class ToOne(Reference, Expr):
         self._promote_by_name()
         if value is None:
             obj._orm_set_column(self.my_column, None)
+            obj._orm_related.pop(self, None)
         else:
             if not isinstance(value, self.other_column.model):
                 raise TypeError('object must be of type %r' %
                                 (self.other_column.model,))
-            obj._orm_set_column(self.my_column,
-                                value._orm_get_column(self.other_column))
+            key = value._orm_get_column(self.other_column)
+            obj._orm_set_column(self.my_column, key)
+            obj._orm_related[self] = (key, value)
+
+    def _orm_resolve(self, obj):
+        try:
+            key, other = obj._orm_related[self]
+        except KeyError:
+            return
+        if other is None or obj._orm_get_column(self.my_column) != key:
+            return
+        value = other._orm_get_column(self.other_column)
+        if value != key:
+            obj._orm_set_column(self.my_column, value)
+            obj._orm_related[self] = (value, other)
 
     def __delete__(self, obj):
         self._promote_by_name()
         obj._orm_del_column(self.my_column)
 
+    def _orm_prefetch(self, objs):
+        self._promote_by_name()
+        values = list(set(obj._orm_get_column(self.my_column)
+                          for obj in objs) - set([None]))
+        found = {}
+        for i in xrange(0, len(values), _IN_BATCH_SIZE):
+            batch = values[i:i + _IN_BATCH_SIZE]
+            for other in self.other_column.model.find(
+                    self.other_column.is_in(batch)):
+                found[other._orm_get_column(self.other_column)] = other
+        for obj in objs:
+            value = obj._orm_get_column(self.my_column)
+            obj._orm_related[self] = (value, found.get(value))
+
     def sql(self):
         return self.my_column.sql()
 
@@ -133,11 +210,49 @@ class ToOne(Reference, Expr):
 
 
 class ToManyResult(Select):
-    def __init__(self, reference, select):
+    def __init__(self, reference, select, prefetched=None):
         super(ToManyResult, self).__init__(select.what, select.sources,
                                            select.where, select.order,
                                            select.slice)
         self.reference = reference
+        self.select = select
+        self.prefetched = prefetched
+
+    def _new(self, what, sources, where, order, slice):
+        return self.select._copy(what=what, sources=sources, where=where,
+                                 order=order, slice=slice)
+
+    def __iter__(self):
+        if self.prefetched is None:
+            return iter(self._copy())
+        return iter(list(self.prefetched))
+
+    def __len__(self):
+        if self.prefetched is None:
+            return len(self._copy())
+        return len(self.prefetched)
+
+    def exists(self):
+        if self.prefetched is None:
+            return self._copy().exists()
+        return bool(self.prefetched)
+
+    def _execute(self, expr=None):
+        return self._copy()._execute(expr)
+
+    def aggregate(self, **aggregates):
+        return self._copy().aggregate(**aggregates)
+
+    def delete(self):
+        self._copy().delete()
+
+    def update(self, **values):
+        return self._copy().update(**values)
+
+    def _remember(self, obj):
+        if self.prefetched is not None and \
+           not any(o is obj for o in self.prefetched):
+            self.prefetched.append(obj)
 
     def add(self, obj):
         if not isinstance(obj, self.reference.other_column.model):
@@ -148,12 +263,14 @@ class ToManyResult(Select):
         obj._orm_set_column(self.reference.other_column, self.where.rvalue)
         obj.save()
         obj._orm_dirty_attrs = dirty
+        self._remember(obj)
 
     def clear(self):
-        u = Update(self.reference.other_column.model,
-                   {self.reference.other_column: None},
-                   self.reference.other_column == self.where.rvalue)
-        connection.cursor().execute(u.sql(), u.args())
+        column = self.reference.other_column
+        column.model.find(column == self.where.rvalue).update(
+            **{column.model._orm_attrs[column.name.split(' ', 1)[0]]: None})
+        if self.prefetched is not None:
+            del self.prefetched[:]
 
 
 class ToMany(Reference):
@@ -163,12 +280,33 @@ class ToMany(Reference):
             return self
         value = obj._orm_get_column(self.my_column)
         return ToManyResult(self,
-            self.other_column.model.find(self.other_column == value))
+            self.other_column.model.find(self.other_column == value),
+            self._orm_prefetched(obj, (value, self._orm_version())))
+
+    def _orm_version(self):
+        return _version(_tables(ModelList([self.other_column.model])))
+
+    def _orm_prefetch(self, objs):
+        self._promote_by_name()
+        version = self._orm_version()
+        values = list(set(obj._orm_get_column(self.my_column)
+                          for obj in objs) - set([None]))
+        found = {}
+        for i in xrange(0, len(values), _IN_BATCH_SIZE):
+            batch = values[i:i + _IN_BATCH_SIZE]
+            for other in self.other_column.model.find(
+                    self.other_column.is_in(batch)):
+                found.setdefault(other._orm_get_column(self.other_column),
+                                 []).append(other)
+        for obj in objs:
+            value = obj._orm_get_column(self.my_column)
+            obj._orm_related[self] = ((value, version),
+                                      found.get(value, []))
 
 
 class ManyToManyResult(ToManyResult):
-    def __init__(self, reference, select, filtered=False):
-        super(ManyToManyResult, self).__init__(reference, select)
+    def __init__(self, reference, select, filtered=False, prefetched=None):
+        super(ManyToManyResult, self).__init__(reference, select, prefetched)
         self.filtered = filtered
 
     def add(self, obj):
@@ -182,6 +320,7 @@ class ManyToManyResult(ToManyResult):
         inst._orm_set_column(self.reference.join_other,
                              obj._orm_get_column(self.reference.other_column))
         inst.save()
+        self._remember(obj)
 
     def find(self, where=None, *ands):
         find = super(ManyToManyResult, self).find(where, *ands)
@@ -196,6 +335,8 @@ class ManyToManyResult(ToManyResult):
         else:
             model.find(self.reference.join_mine ==
                        self.where.lvalue.rvalue).delete()
+            if self.prefetched is not None:
+                del self.prefetched[:]
 
 
 class ManyToMany(Reference):
@@ -223,7 +364,66 @@ class ManyToMany(Reference):
                    ModelList([self.join_mine.model,
                               self.other_column.model]),
                    And(self.join_mine == value,
-                       self.join_other == self.other_column)))
+                       self.join_other == self.other_column)),
+            prefetched=self._orm_prefetched(obj, (value, self._orm_version())))
+
+    def _orm_version(self):
+        return _version(_tables(ModelList([self.join_mine.model,
+                                           self.other_column.model])))
+
+    def _orm_prefetch(self, objs):
+        self._promote_by_name()
+        version = self._orm_version()
+        join = self.join_mine.model
+        other = self.other_column.model
+        what = ExprList([join.pk, self.join_mine] +
+                        other._orm_column_objects())
+        values = list(set(obj._orm_get_column(self.my_column)
+                          for obj in objs) - set([None]))
+        found = {}
+        for i in xrange(0, len(values), _IN_BATCH_SIZE):
+            batch = values[i:i + _IN_BATCH_SIZE]
+            q = Select(what, ModelList([join, other]),
+                       And(self.join_mine.is_in(batch),
+                           self.join_other == self.other_column))
+            for link, target in q:
+                found.setdefault(link._orm_get_column(self.join_mine),
+                                 []).append(target)
+        for obj in objs:
+            value = obj._orm_get_column(self.my_column)
+            obj._orm_related[self] = ((value, version),
+                                      found.get(value, []))
+
+
+class Index(object):
+    def __init__(self, *columns, **kwargs):
+        if not columns:
+            raise TypeError('an index needs at least one column')
+        self.columns = columns
+        self.unique = kwargs.pop('unique', False)
+        self.name = kwargs.pop('name', None)
+        if kwargs:
+            raise TypeError('unexpected keyword arguments: %s' %
+                            (', '.join(sorted(kwargs)),))
+
+    def column_names(self, model):
+        names = []
+        for column in self.columns:
+            if isinstance(column, basestring):
+                column = model._orm_columns[column]
+            else:
+                column = column.name
+            names.append(column.split(' ', 1)[0])
+        return names
+
+    def sql(self, model):
+        names = self.column_names(model)
+        name = self.name
+        if name is None:
+            name = 'ix_%s_%s' % (model._orm_table, '_'.join(names))
+        return 'create %sindex if not exists "%s" on "%s" (%s)' % (
+            'unique ' if self.unique else '', name, model._orm_table,
+            ', '.join('"%s"' % (n,) for n in names))
 
 
 class Model(object):
@@ -233,26 +433,40 @@ class Model(object):
                 return
             cls._orm_attrs = {}
             cls._orm_columns = {}
+            cls._orm_groups = {None: []}
+            cls._orm_indexes = []
             cls._orm_pk_attr = None
             for k in ns:
                 v = ns[k]
-                if isinstance(v, Column):
+                if isinstance(v, Index):
+                    cls._orm_indexes.append(v)
+                elif isinstance(v, Column):
                     if v.name is None:
                         v.name = k
                     cls._orm_attrs[v.name.split(' ', 1)[0]] = k
                     cls._orm_columns[k] = v.name
                     if v.primary:
                         cls._orm_pk_attr = k
+                    else:
+                        cls._orm_groups.setdefault(v.group, []).append(k)
+                        if v.index or v.unique:
+                            cls._orm_indexes.append(Index(k, unique=v.unique))
             if cls._orm_pk_attr is None:
                 cls.pk = Column(name='rowid', primary=True)
                 cls._orm_pk_attr = cls._orm_attrs['rowid'] = 'pk'
                 cls._orm_columns['pk'] = 'rowid'
             cls._orm_obj_cache = WeakValueDictionary()
+            cls._orm_lru = None
+            if cls._orm_cache_size:
+                cls._orm_lru = LRUCache(cls._orm_cache_size,
+                                        cls._orm_cache_ttl)
+            cls._orm_plans = LRUCache(64)
             _REGISTERED[name] = cls
 
     def __new__(cls, *args, **kwargs):
         self = super(Model, cls).__new__(cls)
         self._orm_dirty_attrs = set()
+        self._orm_related = {}
         return self
 
     class pk(object):
@@ -263,11 +477,18 @@ class Model(object):
     pk = pk()
 
     _orm_new_row = True
+    _orm_cache_size = None
+    _orm_cache_ttl = None
+    _orm_shards = None
 
     def __setattr__(self, name, value):
         if name in self._orm_columns:
             if name == self._orm_pk_attr and not self._orm_new_row:
                 self._orm_old_pk = self.pk
+            elif self._orm_shards is not None and not self._orm_new_row and \
+                 name == self._orm_shards.key and \
+                 '_orm_old_key' not in self.__dict__:
+                self._orm_old_key = getattr(self, name)
             self._orm_dirty_attrs.add(name)
         super(Model, self).__setattr__(name, value)
 
@@ -285,7 +506,8 @@ class Model(object):
 
     @classmethod
     def _orm_column_objects(cls):
-        return [getattr(cls, a) for a in cls._orm_attrs.values()]
+        return [getattr(cls, a) for a in cls._orm_attrs.values()
+                if a == cls._orm_pk_attr or a in cls._orm_groups[None]]
 
     def _orm_where_pk(self, old=False):
         pk = self._orm_old_pk if old else self.pk
@@ -301,55 +523,179 @@ class Model(object):
     def _orm_load_column(self, column):
         if self._orm_new_row:
             return None
-        q = Select(column, Sql(self._orm_table), self._orm_where_pk())
-        value = connection.cursor().execute(q.sql(), q.args()).fetchone()[0]
-        if column.converter is not None:
-            value = column.converter(value)
-        attr = self._orm_attrs[column.name]
-        self._orm_setattr(attr, value)
-        self._orm_dirty_attrs.discard(attr)
-        return value
+        cls = type(self)
+        attrs = [attr for attr in cls._orm_groups[column.group]
+                 if attr not in self.__dict__]
+        columns = [getattr(cls, attr) for attr in attrs]
+        q = Select(ExprList(columns), Sql(self._orm_table),
+                   self._orm_where_pk())
+        row = self._orm_execute(q).fetchone()
+        for attr, loaded, value in zip(attrs, columns, row):
+            if loaded.converter is not None:
+                value = loaded.converter(value)
+            self._orm_setattr(attr, value)
+            self._orm_dirty_attrs.discard(attr)
+        return self.__dict__[self._orm_attrs[column.name]]
 
     @classmethod
-    def _orm_load(cls, row, description):
-        for i, column in enumerate(description):
-            if column[0] == cls.pk.name:
-                pk = row[i]
-                if cls.pk.converter is not None:
-                    pk = cls.pk.converter(pk)
-                break
-        else:
-            raise TypeError('primary key must be present in arguments')
-        if pk in cls._orm_obj_cache:
-            self = cls._orm_obj_cache[pk]
-        else:
-            self = cls.__new__(cls)
-            self._orm_new_row = False
-        for i, column in enumerate(description):
-            column = column[0]
-            value = row[i]
+    def _orm_plan(cls, names, indexes=None):
+        if indexes is None:
+            indexes = range(len(names))
+        key = (tuple(names), tuple(indexes))
+        plan = cls._orm_plans.get(key)
+        if plan is None:
+            plan = cls._orm_compile_plan(names, indexes)
+            cls._orm_plans.put(key, plan)
+        return plan
+
+    @classmethod
+    def _orm_compile_plan(cls, names, indexes):
+        pk_index = None
+        cells = []
+        for name, index in zip(names, indexes):
             try:
-                attr = self._orm_attrs[column]
+                attr = cls._orm_attrs[name]
             except KeyError:
-                self._orm_setattr(column, value)
-                return
-            if not attr in self._orm_dirty_attrs:
-                column = getattr(cls, attr)
-                if column.converter is not None:
-                    value = column.converter(value)
-                self._orm_setattr(attr, value)
-        cls._orm_obj_cache[pk] = self
-        return self
+                cells.append((index, name, None))
+                continue
+            converter = getattr(cls, attr).converter
+            if attr == cls._orm_pk_attr:
+                pk_index, pk_converter = index, converter
+            cells.append((index, attr, converter))
+        if pk_index is None:
+            raise TypeError('primary key must be present in arguments')
+        cells = tuple(cells)
+        cache = cls._orm_obj_cache
+        lru = cls._orm_lru
+
+        def load(row):
+            pk = row[pk_index]
+            if pk_converter is not None:
+                pk = pk_converter(pk)
+            self = cache.get(pk)
+            if self is None:
+                self = cls.__new__(cls)
+                self._orm_new_row = False
+            elif self._orm_related:
+                related = self._orm_related
+                for reference in [r for r in related if r._orm_many]:
+                    del related[reference]
+            dirty = self._orm_dirty_attrs
+            d = self.__dict__
+            for index, attr, converter in cells:
+                if attr in dirty:
+                    continue
+                value = row[index]
+                if converter is not None:
+                    value = converter(value)
+                d[attr] = value
+            cache[pk] = self
+            if lru is not None:
+                lru.put(pk, self)
+            return self
+        return load
+
+    @classmethod
+    def _orm_load(cls, row, description):
+        return cls._orm_plan(tuple(column[0] for column in description))(row)
+
+    @classmethod
+    def _orm_cached(cls, pk):
+        if cls._orm_lru is not None:
+            obj = cls._orm_lru.get(pk)
+            if obj is not None:
+                return obj
+        obj = cls._orm_obj_cache.get(pk)
+        if obj is not None and cls._orm_lru is not None:
+            cls._orm_lru.put(pk, obj)
+        return obj
+
+    @classmethod
+    def _orm_remember(cls, obj):
+        cls._orm_obj_cache[obj.pk] = obj
+        if cls._orm_lru is not None:
+            cls._orm_lru.put(obj.pk, obj)
+
+    @classmethod
+    def _orm_forget(cls, pk):
+        cls._orm_obj_cache.pop(pk, None)
+        if cls._orm_lru is not None:
+            cls._orm_lru.discard(pk)
+
+    @classmethod
+    def cache_stats(cls):
+        lru = cls._orm_lru
+        stats = dict(weak=len(cls._orm_obj_cache), size=0, maxsize=0,
+                     hits=0, misses=0, evictions=0, hit_ratio=0.0)
+        if lru is not None:
+            stats.update(size=len(lru), maxsize=lru.maxsize, hits=lru.hits,
+                         misses=lru.misses, evictions=lru.evictions,
+                         hit_ratio=lru.hit_ratio)
+        return stats
+
+    @classmethod
+    def create_table(cls):
+        columns = sorted((v for v in (getattr(cls, attr)
+                                      for attr in cls._orm_columns)
+                          if not isinstance(v, SqlColumn) and
+                          v.name != 'rowid'),
+                         key=lambda column: column._order)
+        connection.cursor().execute('create table if not exists "%s" (%s)' % (
+            cls._orm_table,
+            ', '.join(column._definition() for column in columns)))
+
+    @classmethod
+    def suggested_indexes(cls):
+        indexed = set(index.column_names(cls)[0]
+                      for index in cls._orm_indexes)
+        indexed.add(cls.pk.name)
+        suggested = []
+        for model in _REGISTERED.values():
+            for klass in model.__mro__:
+                for value in klass.__dict__.values():
+                    if not isinstance(value, Reference):
+                        continue
+                    try:
+                        value._promote_by_name()
+                    except RuntimeError:
+                        continue
+                    for column in (value.other_column,
+                                   getattr(value, 'join_mine', None),
+                                   getattr(value, 'join_other', None)):
+                        if getattr(column, 'model', None) is not cls:
+                            continue
+                        name = column.name.split(' ', 1)[0]
+                        if name not in indexed:
+                            indexed.add(name)
+                            suggested.append(Index(cls._orm_attrs[name]))
+        return suggested
+
+    @classmethod
+    def create_indexes(cls, suggested=False):
+        indexes = list(cls._orm_indexes)
+        if suggested:
+            indexes.extend(cls.suggested_indexes())
+        cursor = connection.cursor()
+        for index in indexes:
+            cursor.execute(index.sql(cls))
+        return indexes
 
     @classmethod
     def find(cls, where=None, *ands):
         if ands:
             where = reduce(And, ands, where)
+        if cls._orm_shards is not None:
+            return cls._orm_shards.find(cls, where)
         return Select(ExprList(cls._orm_column_objects()),
                       ModelList([cls]), where)
 
     @classmethod
     def get(cls, pk):
+        obj = cls._orm_cached(pk)
+        if obj is not None:
+            return obj
+        if cls._orm_shards is not None:
+            return cls._orm_shards.get(cls, pk)
         try:
             return Select(ExprList(cls._orm_column_objects()),
                           ModelList([cls]), cls.pk == pk)[0]
@@ -360,40 +706,189 @@ class Model(object):
         for attr in self._orm_columns:
             if attr == self._orm_pk_attr:
                 continue
-            delattr(self, attr)
+            self.__dict__.pop(attr, None)
 
     def delete(self):
         if self._orm_new_row:
             return
-        if self.pk in self._orm_obj_cache:
-            del self._orm_obj_cache[self.pk]
+        self._orm_forget(self.pk)
         q = Delete(Sql(self._orm_table), self._orm_where_pk())
-        connection.cursor().execute(q.sql(), q.args())
+        self._orm_execute(q)
+        self._orm_mark_deleted()
+
+    def _orm_mark_deleted(self):
         self._orm_new_row = True
         self._orm_dirty_attrs.update(self._orm_columns)
         self._orm_dirty_attrs.remove(self._orm_pk_attr)
         delattr(self, self._orm_pk_attr)
 
-    def save(self):
+    @classmethod
+    def _orm_conflict(cls, attrs):
+        if cls._orm_pk_attr in attrs:
+            return [cls._orm_pk_attr]
+        for index in cls._orm_indexes:
+            if index.unique:
+                keys = [cls._orm_attrs[name]
+                        for name in index.column_names(cls)]
+                if all(key in attrs for key in keys):
+                    return keys
+        raise TypeError('upsert requires the primary key or the columns of '
+                        'a unique index')
+
+    @classmethod
+    def _orm_upserted(cls, keys, objs, cursor):
+        if cls._orm_pk_attr not in keys:
+            on = ' and '.join('%s = v.column%d' % (getattr(cls, key).sql(), n)
+                              for n, key in enumerate(keys, 2))
+            size = _IN_BATCH_SIZE // (len(keys) + 1)
+            for i in xrange(0, len(objs), size):
+                batch = objs[i:i + size]
+                row = '(%s)' % (', '.join('?' * (len(keys) + 1)),)
+                sql = 'select v.column1, %s from (values %s) as v ' \
+                      'join "%s" on %s' % (cls.pk.sql(),
+                                           ', '.join([row] * len(batch)),
+                                           cls._orm_table, on)
+                args = []
+                for n, obj in enumerate(batch):
+                    args.append(n)
+                    args.extend(obj._orm_adapt_attr(key) for key in keys)
+                for n, pk in cursor.execute(sql, args):
+                    batch[n]._orm_setattr(cls._orm_pk_attr, pk)
+        merged = []
+        for obj in objs:
+            other = cls._orm_cached(obj.pk)
+            if other is not None and other is not obj:
+                for attr in obj._orm_dirty_attrs:
+                    other._orm_setattr(attr, obj.__dict__[attr])
+                    other._orm_dirty_attrs.discard(attr)
+                merged.append(obj)
+        return merged
+
+    def save(self, upsert=False):
         if not self._orm_dirty_attrs and not self._orm_new_row:
             return
-        values = dict((getattr(type(self), attr), self._orm_adapt_attr(attr))
-                      for attr in self._orm_dirty_attrs)
-        if self._orm_new_row:
+        shard = None
+        if self._orm_shards is not None:
+            shard = self._orm_shards.index_for(self)
+        values = OrderedDict((getattr(type(self), attr),
+                              self._orm_adapt_attr(attr))
+                             for attr in sorted(self._orm_dirty_attrs))
+        upsert = upsert and self._orm_new_row
+        if upsert:
+            keys = self._orm_conflict(self._orm_dirty_attrs)
+            upsert = None not in [self._orm_adapt_attr(key) for key in keys]
+        if upsert:
+            q = Insert(self, values, [getattr(type(self), key)
+                                      for key in keys])
+        elif self._orm_new_row:
             q = Insert(self, values)
         else:
             if self._orm_pk_attr in self._orm_dirty_attrs:
                 where = self._orm_where_pk(True)
-                if self._orm_old_pk in self._orm_obj_cache:
-                    del self._orm_obj_cache[self._orm_old_pk]
+                self._orm_forget(self._orm_old_pk)
                 del self._orm_old_pk
             else:
                 where = self._orm_where_pk()
             q = Update(self, values, where)
-        cursor = connection.cursor()
-        cursor.execute(q.sql(), q.args())
-        if self._orm_new_row:
-            self._orm_new_row = False
+        cursor = self._orm_execute(q, shard)
+        merged = ()
+        if upsert:
+            merged = self._orm_upserted(keys, [self], cursor)
+        elif self._orm_new_row:
             self._orm_setattr(self._orm_pk_attr, cursor.lastrowid)
+        self._orm_new_row = False
         self._orm_dirty_attrs.clear()
-        self._orm_obj_cache[self.pk] = self
+        self.__dict__.pop('_orm_old_key', None)
+        if not merged:
+            self._orm_remember(self)
+
+    def _orm_execute(self, q, shard=None):
+        if self._orm_shards is None:
+            return execute(q)
+        if shard is None:
+            shard = self._orm_shards.index_for(self)
+        with self._orm_shards.using(shard):
+            return execute(q)
+
+    def asave(self):
+        def save():
+            self.save()
+            connection.commit()
+        return submit(save)
+
+    @classmethod
+    def _orm_insert_many(cls, attrs, objs, upsert=False):
+        if cls._orm_shards is None:
+            return cls._orm_insert_rows(attrs, objs, upsert)
+        shards = OrderedDict()
+        for obj in objs:
+            shards.setdefault(cls._orm_shards.index_for(obj), []).append(obj)
+        for index, group in shards.iteritems():
+            with cls._orm_shards.using(index):
+                cls._orm_insert_rows(attrs, group, upsert)
+
+    @classmethod
+    def _orm_insert_rows(cls, attrs, objs, upsert=False):
+        values = OrderedDict((getattr(cls, attr), None) for attr in attrs)
+        plain, keyed = objs, ()
+        if upsert:
+            keys = cls._orm_conflict(attrs)
+            plain, keyed = [], []
+            for obj in objs:
+                if None in [obj._orm_adapt_attr(key) for key in keys]:
+                    plain.append(obj)
+                else:
+                    keyed.append(obj)
+        merged = ()
+        with connection.atomic():
+            if keyed:
+                q = Insert(cls, values, [getattr(cls, key) for key in keys])
+                cursor = execute_many(q, [[obj._orm_adapt_attr(attr)
+                                           for attr in attrs]
+                                          for obj in keyed])
+                merged = cls._orm_upserted(keys, keyed, cursor)
+            if plain:
+                cursor = execute_many(Insert(cls, values),
+                                      [[obj._orm_adapt_attr(attr)
+                                        for attr in attrs] for obj in plain])
+                if cls._orm_pk_attr not in attrs:
+                    last = cursor.execute(
+                        'select last_insert_rowid()').fetchone()[0]
+                    for pk, obj in enumerate(plain, last - len(plain) + 1):
+                        obj._orm_setattr(cls._orm_pk_attr, pk)
+        for obj in objs:
+            obj._orm_new_row = False
+            obj._orm_dirty_attrs.clear()
+            if not any(obj is other for other in merged):
+                cls._orm_remember(obj)
+
+    @classmethod
+    def save_many(cls, objs, upsert=False):
+        groups = OrderedDict()
+        for obj in objs:
+            if not isinstance(obj, cls):
+                raise TypeError('object must be of type %r' % (cls,))
+            if obj._orm_new_row:
+                key = tuple(sorted(obj._orm_dirty_attrs))
+                groups.setdefault(key, []).append(obj)
+            else:
+                obj.save()
+        for attrs, group in groups.iteritems():
+            cls._orm_insert_many(attrs, group, upsert)
+
+    @classmethod
+    def insert_many(cls, rows, upsert=False):
+        objs = []
+        for row in rows:
+            obj = cls.__new__(cls)
+            for attr, value in row.iteritems():
+                setattr(obj, attr, value)
+            objs.append(obj)
+        cls.save_many(objs, upsert)
+        if upsert:
+            objs = [cls._orm_obj_cache.get(obj.pk, obj) for obj in objs]
+        return objs
+
+    @classmethod
+    def upsert_many(cls, rows):
+        return cls.insert_many(rows, upsert=True)
@@ -0,0 +1,143 @@
+import re
+import sys
+import threading
+from collections import deque, Counter
+
+from orm import connection
+
+
+__all__ = ['Statement', 'Profiler', 'enable', 'disable', 'reset', 'report']
+
+
+_numbers = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_lists = re.compile(r'\?(?:\s*,\s*\?)+')
+_space = re.compile(r'\s+')
+
+
+def normalize(sql):
+    sql = _numbers.sub('?', sql)
+    sql = _lists.sub('?, ...', sql)
+    return _space.sub(' ', sql).strip()
+
+
+def _caller():
+    frame = sys._getframe(3)
+    while frame is not None:
+        name = frame.f_globals.get('__name__', '')
+        if name != 'orm' and not name.startswith('orm.'):
+            code = frame.f_code
+            return '%s:%d(%s)' % (code.co_filename, frame.f_lineno,
+                                  code.co_name)
+        frame = frame.f_back
+
+
+class Statement(object):
+    def __init__(self, sql, samples):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.sites = Counter()
+        self.timings = deque(maxlen=samples)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    @property
+    def p99(self):
+        if not self.timings:
+            return 0.0
+        timings = sorted(self.timings)
+        return timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+    @property
+    def site(self):
+        if self.sites:
+            return self.sites.most_common(1)[0][0]
+
+
+class Profiler(object):
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.statements = {}
+        self._normalized = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        connection.on_execute(self.executed)
+        connection.on_rows(self.fetched)
+
+    def stop(self):
+        connection.remove_hook(self.executed)
+        connection.remove_hook(self.fetched)
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+
+    def _statement(self, sql):
+        try:
+            key = self._normalized[sql]
+        except KeyError:
+            key = self._normalized.setdefault(sql, normalize(sql))
+        try:
+            return self.statements[key]
+        except KeyError:
+            return self.statements.setdefault(
+                key, Statement(key, self.samples))
+
+    def executed(self, sql, args, elapsed):
+        site = _caller()
+        with self._lock:
+            stmt = self._statement(sql)
+            stmt.count += 1
+            stmt.total += elapsed
+            stmt.timings.append(elapsed)
+            stmt.sites[site] += 1
+
+    def fetched(self, sql, rows):
+        with self._lock:
+            self._statement(sql).rows += rows
+
+    def report(self, sort='total', limit=None):
+        stmts = sorted(self.statements.values(),
+                       key=lambda stmt: getattr(stmt, sort), reverse=True)
+        if limit is not None:
+            stmts = stmts[:limit]
+        lines = ['%8s %10s %10s %10s %8s  %s' % (
+            'count', 'total ms', 'mean ms', 'p99 ms', 'rows', 'statement')]
+        for stmt in stmts:
+            lines.append('%8d %10.3f %10.3f %10.3f %8d  %s' % (
+                stmt.count, stmt.total * 1000, stmt.mean * 1000,
+                stmt.p99 * 1000, stmt.rows, stmt.sql))
+            lines.append('%s  at %s' % (' ' * 50, stmt.site))
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
+
+
+def enable():
+    profiler.start()
+
+
+def disable():
+    profiler.stop()
+
+
+def reset():
+    profiler.reset()
+
+
+def report(sort='total', limit=None):
+    return profiler.report(sort, limit)
@@ -1,16 +1,223 @@
+import re
+import logging
+import itertools
+import threading
+from collections import namedtuple, OrderedDict
+
 from orm import connection
-from orm.util import slice2limit
+from orm.cache import LRUCache
+from orm.executor import submit
+from orm.util import slice2limit, is_negative, reverse_slice
 
 
 __all__ = (
     'Expr UnaryOp BinaryOp '
     'Not Pos Neg Lt Le Eq Gt Ge Ne And Or Add Sub Mul Div Mod '
     'In Like Glob Match Regexp Sql ExprList ModelList '
-    'Asc Desc Select Delete Insert Update'
+    'Asc Desc Alias Aggregate Count Sum Avg Min Max Total '
+    'Select Delete Insert Update '
+    'StatementCache statement_cache ResultCache result_cache '
+    'execute execute_many FullScanError strict'
 ).split()
 
 
+log = logging.getLogger(__name__)
+
+_IN_BATCH_SIZE = 500
+
+
+class StatementCache(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expr):
+        sql = expr._compiled
+        if sql is None:
+            self.misses += 1
+            sql = expr._compiled = expr.sql()
+        else:
+            self.hits += 1
+        return sql, expr.args()
+
+
+statement_cache = StatementCache()
+
+
+def _nested(value):
+    if isinstance(value, Select):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for select in _nested(item):
+                yield select
+    elif isinstance(value, Expr):
+        for item in vars(value).itervalues():
+            for select in _nested(item):
+                yield select
+
+
+def _tables(sources):
+    if isinstance(sources, Select):
+        tables = _tables(sources.sources)
+        for select in _nested([sources.what, sources.where, sources._having]):
+            tables |= _tables(select)
+        return tables
+    if isinstance(sources, ModelList):
+        names = [model._orm_table for model in sources]
+    elif isinstance(sources, Sql):
+        names = sources.value.split(',')
+    else:
+        names = [sources.sql()]
+    return frozenset(name.strip().strip('"').lower() for name in names)
+
+
+class _CachedCursor(object):
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = iter(rows)
+
+    def __iter__(self):
+        return self.rows
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size=1):
+        return [row for i, row in zip(xrange(size), self.rows)]
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class ResultCache(LRUCache):
+    def __init__(self, maxsize=256):
+        super(ResultCache, self).__init__(maxsize)
+        self._keys = {}
+        self._written = threading.local()
+
+    def _evicted(self, key, value):
+        for table in value[0]:
+            self._keys.get(table, set()).discard(key)
+
+    def fetch(self, expr):
+        sql, args = statement_cache.compile(expr)
+        try:
+            key = (sql, tuple(args))
+            hit = self.get(key)
+        except TypeError:
+            return connection.cursor(readonly=True).execute(sql, args)
+        if hit is None:
+            cursor = connection.cursor(readonly=True).execute(sql, args)
+            tables = _tables(expr)
+            hit = (tables, cursor.description, tuple(cursor.fetchall()))
+            self.put(key, hit)
+            with self._lock:
+                for table in tables:
+                    self._keys.setdefault(table, set()).add(key)
+        return _CachedCursor(hit[1], hit[2])
+
+    def invalidate(self, tables):
+        if not self._keys:
+            return
+        with self._lock:
+            for table in tables:
+                for key in self._keys.pop(table, ()):
+                    self._items.pop(key, None)
+
+    def written(self, tables):
+        self.invalidate(tables)
+        pending = getattr(self._written, 'tables', None)
+        if pending is None:
+            pending = self._written.tables = set()
+        pending.update(tables)
+
+    def ended(self):
+        tables = getattr(self._written, 'tables', None)
+        if tables:
+            self._written.tables = None
+            self.invalidate(tables)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._keys.clear()
+
+
+result_cache = ResultCache()
+connection.on_end(result_cache.ended)
+
+
+class FullScanError(RuntimeError):
+    pass
+
+
+_strict = None
+_plans = LRUCache(1024)
+_full_scan = re.compile(r'^SCAN (?:TABLE )?(\S+)')
+
+
+def strict(mode='raise'):
+    global _strict
+    if mode not in (None, 'warn', 'raise'):
+        raise ValueError('mode must be None, "warn" or "raise"')
+    _strict = mode
+    _plans.clear()
+
+
+def _check_scans(expr):
+    sql, args = statement_cache.compile(expr)
+    scans = _plans.get(sql)
+    if scans is None:
+        plan = connection.cursor(readonly=True).execute(
+            'explain query plan ' + sql, args).fetchall()
+        scans = tuple(row[-1] for row in plan
+                      if _full_scan.match(row[-1]) and
+                      'INDEX' not in row[-1])
+        _plans.put(sql, scans)
+    if not scans:
+        return
+    message = 'full table scan (%s) in: %s' % ('; '.join(scans), sql)
+    if _strict == 'raise':
+        raise FullScanError(message)
+    log.warning(message)
+
+
+_writes = itertools.count(1)
+_versions = {}
+
+
+def _written(tables):
+    version = next(_writes)
+    for table in tables:
+        _versions[table] = version
+    result_cache.written(tables)
+
+
+def _version(tables):
+    return max(_versions.get(table, 0) for table in tables)
+
+
+def execute(expr):
+    sql, args = statement_cache.compile(expr)
+    cursor = connection.cursor(readonly=isinstance(expr, Select))
+    cursor.execute(sql, args)
+    if isinstance(expr, (Insert, Update, Delete)):
+        _written(expr.tables())
+    return cursor
+
+
+def execute_many(expr, rows):
+    sql = statement_cache.compile(expr)[0]
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    _written(expr.tables())
+    return cursor
+
+
 class Expr(object):
+    _compiled = None
+
     def __init__(self, value):
         self.value = value
 
@@ -127,7 +334,6 @@ binary_ops = [
     ('Gt', '>'),
     ('Le', '<='),
     ('Ge', '>='),
-    ('And', 'and'),
     ('Or', 'or'),
     ('Add', '+'),
     ('Sub', '-'),
@@ -144,6 +350,16 @@ for classname, op in binary_ops:
 del classname, op, binary_ops
 
 
+class And(BinaryOp):
+    _op = 'and'
+
+    def sql(self):
+        return ' and '.join(
+            '(%s)' % (v.sql(),) if isinstance(v, Or) else
+            v.sql() if hasattr(v, 'sql') else '?'
+            for v in (self.lvalue, self.rvalue))
+
+
 class Eq(BinaryOp):
     _op = '='
 
@@ -175,8 +391,14 @@ class Ne(BinaryOp):
 class In(BinaryOp):
     _op = 'in'
 
+    def __init__(self, lvalue, rvalue):
+        if isinstance(rvalue, (list, tuple, set, frozenset)) and not \
+           isinstance(rvalue, ExprList):
+            rvalue = ExprList(rvalue)
+        super(In, self).__init__(lvalue, rvalue)
+
     def sql(self):
-        if isinstance(self.rvalue, Select):
+        if isinstance(self.rvalue, (Select, ExprList)):
             return '%s in (%s)' % (self.lvalue.sql(), self.rvalue.sql())
         return super(In, self).sql()
 
@@ -222,7 +444,60 @@ class Desc(Expr):
         return super(Desc, self).sql() + ' desc'
 
 
+class Alias(Expr):
+    def __init__(self, value, name):
+        self.value = value
+        self.name = name
+
+    def sql(self):
+        return super(Alias, self).sql() + ' as "%s"' % (self.name,)
+
+
+class Aggregate(Expr):
+    def __init__(self, value=None, distinct=False):
+        self.value = value
+        self.distinct = distinct
+
+    def sql(self):
+        if self.value is None:
+            expr = '*'
+        else:
+            expr = super(Aggregate, self).sql()
+        if self.distinct:
+            expr = 'distinct ' + expr
+        return '%s(%s)' % (self._func, expr)
+
+    def args(self):
+        if self.value is None:
+            return []
+        return super(Aggregate, self).args()
+
+
+aggregates = [
+    ('Count', 'count'),
+    ('Sum', 'sum'),
+    ('Avg', 'avg'),
+    ('Min', 'min'),
+    ('Max', 'max'),
+    ('Total', 'total'),
+]
+for classname, func in aggregates:
+    locals()[classname] = type(classname, (Aggregate,), dict(_func=func))
+del classname, func, aggregates
+
+
 class Select(Expr):
+    related = ()
+    reverse = False
+    cached = False
+    projection = None
+    group = None
+    annotations = ()
+    _having = None
+
+    _options = ('related', 'reverse', 'cached', 'projection',
+                'group', 'annotations', '_having')
+
     def __init__(self, what=None, sources=None,
                  where=None, order=None, slice=None):
         if what is None:
@@ -235,75 +510,379 @@ class Select(Expr):
         self.order = order
         self.slice = slice
 
+    def _new(self, what, sources, where, order, slice):
+        return Select(what, sources, where, order, slice)
+
+    def _copy(self, **kwargs):
+        s = self._new(self.what, self.sources, self.where, self.order,
+                      self.slice)
+        for name in self._options:
+            if name in self.__dict__:
+                setattr(s, name, self.__dict__[name])
+        for name, value in kwargs.iteritems():
+            setattr(s, name, value)
+        return s
+
+    def _order_items(self):
+        if self.order is None:
+            return []
+        if isinstance(self.order, ExprList):
+            return list(self.order)
+        return [self.order]
+
+    def _reversed(self):
+        if self.order is not None:
+            order = ExprList(item.value if isinstance(item, Desc) else
+                             Desc(item.value if isinstance(item, Asc) else item)
+                             for item in self._order_items())
+        elif isinstance(self.sources, ModelList) and len(self.sources) == 1:
+            order = ExprList([Desc(self.sources[0].pk)])
+        else:
+            raise NotImplementedError('negative indices require an order')
+        return self._copy(order=order, reverse=not self.reverse)
+
     def __getitem__(self, key):
-        s = Select(self.what, self.sources, self.where, self.order)
         if isinstance(key, (int, long)):
-            s.slice = slice(key, key + 1)
+            if key < 0:
+                s = self._reversed()._copy(slice=slice(-key - 1, -key))
+            else:
+                s = self._copy(slice=slice(key, key + 1))
             try:
                 return iter(s).next()
             except StopIteration:
                 raise IndexError(key)
-        s.slice = key
-        return s
+        if is_negative(key):
+            return self._reversed()._copy(slice=reverse_slice(key))
+        return self._copy(slice=key)
 
     def __iter__(self):
-        cursor = connection.cursor()
-        result = cursor.execute(self.sql(), self.args())
+        if self.projection is not None:
+            rows = self._project()
+            if self.reverse:
+                rows = reversed(list(rows))
+            return iter(rows)
+        if not self.related and not self.reverse:
+            return self._iter()
+        results = list(self._iter())
+        if self.reverse:
+            results.reverse()
+        self._load_related(results)
+        return iter(results)
+
+    def values(self, *columns):
+        return self._copy(what=ExprList(columns), projection='tuple')
+
+    def tuples(self):
+        return self._copy(projection='tuple')
+
+    def namedtuples(self):
+        return self._copy(projection='namedtuple')
+
+    def _project(self):
+        result = self._execute()
+        items = self.what if isinstance(self.what, ExprList) else [self.what]
+        description = result.description
+        if len(items) != len(description):
+            items = [None] * len(description)
+        converters = [getattr(item, 'converter', None) for item in items]
+        if self.projection == 'namedtuple':
+            names = []
+            for item, column in zip(items, description):
+                model = getattr(item, 'model', None)
+                if model is not None and column[0] in model._orm_attrs:
+                    names.append(model._orm_attrs[column[0]])
+                else:
+                    names.append(column[0])
+            make = namedtuple('Row', names, rename=True)._make
+        else:
+            make = tuple
+        if not any(converters):
+            if make is tuple:
+                return result
+            return (make(row) for row in result)
+        return (make([value if convert is None else convert(value)
+                      for value, convert in zip(row, converters)])
+                for row in result)
+
+    def _load_related(self, results):
+        objs = []
+        for result in results:
+            objs.extend(result if isinstance(result, tuple) else (result,))
+        for model, reference in self.related:
+            reference._orm_prefetch([obj for obj in objs
+                                     if isinstance(obj, model)])
+
+    def _execute(self, expr=None):
+        if expr is None:
+            expr = self
+        if _strict is not None and expr.where is not None:
+            _check_scans(expr)
+        if self.cached and self.sources is not None:
+            return result_cache.fetch(expr)
+        return execute(expr)
+
+    def cache(self):
+        return self._copy(cached=True)
+
+    def _iter(self):
+        result = self._execute()
         if isinstance(self.sources, ModelList):
-            description = cursor.description
-            for row in result:
-                res = []
-                for model in self.sources:
-                    mdesc = tuple((description[i][0], i)
-                                  for i, c in enumerate(self.what)
-                                  if c.model is model)
-                    if not mdesc:
-                        continue
-                    mrow = tuple(row[d[1]] for d in mdesc)
-                    res.append(model._orm_load(mrow, mdesc))
-                yield tuple(res) if len(res) > 1 else res[0]
+            plans = self._plans(result.description)
+            if len(plans) == 1:
+                load = plans[0]
+                for row in result:
+                    yield load(row)
+            else:
+                for row in result:
+                    yield tuple(load(row) for load in plans)
         else:
             for row in result:
                 yield row
 
+    def _plans(self, description):
+        plans = []
+        for model in self.sources:
+            indexes = [i for i, c in enumerate(self.what) if c.model is model]
+            if indexes:
+                names = [description[i][0] for i in indexes]
+                plans.append(model._orm_plan(names, indexes))
+        return plans
+
     def __len__(self):
-        s = Select(Sql('count(*)'), self.sources,
-                   self.where, self.order, self.slice)
-        return connection.cursor().execute(s.sql(), s.args()).fetchone()[0]
+        if self.group is not None:
+            s = Select(Sql('count(*)'), self)
+        else:
+            s = Select(Sql('count(*)'), self.sources,
+                       self.where, self.order, self.slice)
+        return self._execute(s).fetchone()[0]
 
     def exists(self):
-        s = Select(Sql('1'), self.sources, self.where, self.order, self.slice)
-        return connection.cursor().execute(s.sql(), s.args()).fetchone() is not None
+        if self.group is not None:
+            s = Select(Sql('1'), self, slice=slice(1))
+        else:
+            s = Select(Sql('1'), self.sources, self.where, self.order,
+                       self.slice)
+        return self._execute(s).fetchone() is not None
+
+    def _keyset(self, model):
+        keys = []
+        for item in self._order_items():
+            descending = isinstance(item, Desc)
+            if isinstance(item, (Asc, Desc)):
+                item = item.value
+            if getattr(item, 'model', None) is not model:
+                raise TypeError('chunked iteration can only order by '
+                                'columns of %r' % (model,))
+            keys.append((item, descending))
+        if not any(column.name == model.pk.name for column, d in keys):
+            keys.append((model.pk, False))
+        return keys
+
+    def iter_chunks(self, size):
+        if not isinstance(self.sources, ModelList) or len(self.sources) != 1:
+            raise TypeError('chunked iteration requires a single model')
+        if self.slice is not None:
+            raise TypeError('chunked iteration does not support slices')
+        model = self.sources[0]
+        keys = self._keyset(model)
+        order = ExprList(Desc(column) if descending else column
+                         for column, descending in keys)
+        where = self.where
+        while True:
+            s = self._copy(where=where, order=order, slice=slice(size))
+            result = s._execute()
+            load = s._plans(result.description)[0]
+            chunk = [load(row) for row in result.fetchmany(size)]
+            if not chunk:
+                return
+            s._load_related(chunk)
+            yield chunk
+            if len(chunk) < size:
+                return
+            after = _after(keys, chunk[-1])
+            where = after if self.where is None else self.where & after
+
+    def explain(self):
+        sql, args = statement_cache.compile(self)
+        cursor = connection.cursor(readonly=True).execute(
+            'explain query plan ' + sql, args)
+        row = namedtuple('PlanRow', [d[0] for d in cursor.description],
+                         rename=True)
+        return [row._make(r) for r in cursor]
+
+    def afetch(self):
+        return submit(list, self)
+
+    def acount(self):
+        return submit(len, self)
+
+    def aexists(self):
+        return submit(self.exists)
 
     def find(self, where=None, *ands):
         if ands:
             where = reduce(And, ands, where)
-        if self.where is not None:
+        if where is None:
+            where = self.where
+        elif self.where is not None:
             where = self.where & where
-        return Select(self.what, self.sources, where, self.order, self.slice)
+        return self._copy(where=where)
 
     def order_by(self, *args):
         if self.order is not None:
-            order = ExprList(self.order)
+            order = ExprList(self._order_items())
             order.extend(args)
         elif args:
             order = ExprList(args)
         else:
             order = None
-        return Select(self.what, self.sources, self.where, order, self.slice)
+        return self._copy(order=order)
+
+    def aggregate(self, **aggregates):
+        names = sorted(aggregates)
+        what = ExprList(Alias(aggregates[name], name) for name in names)
+        where = self.where
+        if self.slice is not None:
+            if not isinstance(self.sources, ModelList) or \
+               len(self.sources) != 1:
+                raise TypeError('sliced aggregates require a single model')
+            pk = self.sources[0].pk
+            where = pk.is_in(Select(pk, self.sources, self.where,
+                                    self.order, self.slice))
+        s = Select(what, self.sources, where)
+        return dict(zip(names, self._execute(s).fetchone()))
+
+    def _grouped(self, group, annotations):
+        what = ExprList(group)
+        what.extend(Alias(expr, name) for name, expr in annotations)
+        return self._copy(what=what, group=group, annotations=annotations,
+                          projection='namedtuple')
+
+    def group_by(self, *columns):
+        group = ExprList(self.group or ())
+        group.extend(columns)
+        return self._grouped(group, self.annotations)
+
+    def annotate(self, **aggregates):
+        if self.group is None:
+            raise TypeError('annotate requires group_by')
+        annotations = self.annotations + tuple(sorted(aggregates.items()))
+        return self._grouped(self.group, annotations)
+
+    def having(self, condition, *ands):
+        if self.group is None:
+            raise TypeError('having requires group_by')
+        if ands:
+            condition = reduce(And, ands, condition)
+        if self._having is not None:
+            condition = self._having & condition
+        return self._copy(_having=condition)
+
+    def _owner(self, reference, many):
+        if getattr(reference, '_orm_many', many) != many:
+            raise TypeError('%r is not a %s reference' % (
+                reference, 'to-many' if many else 'to-one'))
+        if isinstance(self.sources, ModelList):
+            for model in self.sources:
+                for cls in model.__mro__:
+                    if any(v is reference for v in cls.__dict__.values()):
+                        return model
+        raise TypeError('%r is not a reference of the selected models' %
+                        (reference,))
+
+    def select_related(self, *references):
+        related = tuple((self._owner(reference, False), reference)
+                        for reference in references)
+        return self._copy(related=self.related + related)
+
+    def prefetch(self, *references):
+        related = tuple((self._owner(reference, True), reference)
+                        for reference in references)
+        return self._copy(related=self.related + related)
+
+    def _restricted(self, model):
+        if self.order is None and self.slice is None:
+            return self.where
+        return model.pk.is_in(Select(model.pk, self.sources, self.where,
+                                     self.order, self.slice))
+
+    def _affected(self, model, where):
+        return [row[0] for row in execute(Select(model.pk, self.sources, where))]
+
+    def _cached(self, model, where):
+        cached = list(model._orm_obj_cache.keys())
+        if model.pk.adapter is not None:
+            cached = map(model.pk.adapter, cached)
+        converter = model.pk.converter
+        objs = []
+        for i in xrange(0, len(cached), _IN_BATCH_SIZE):
+            restrict = model.pk.is_in(cached[i:i + _IN_BATCH_SIZE])
+            for pk in self._affected(
+                    model, restrict if where is None else And(where, restrict)):
+                if converter is not None:
+                    pk = converter(pk)
+                obj = model._orm_obj_cache.get(pk)
+                if obj is not None:
+                    objs.append(obj)
+        return objs
+
+    def _delete(self, q):
+        execute(q)
 
     def delete(self):
         if self.sources is None:
             raise TypeError("can't delete without sources")
-        d = Delete(self.sources, self.where, self.order, self.slice)
-        connection.cursor().execute(d.sql(), d.args())
+        objs = ()
+        if isinstance(self.sources, ModelList) and len(self.sources) == 1:
+            model = self.sources[0]
+            objs = self._cached(model, self._restricted(model))
+        self._delete(Delete(self.sources, self.where, self.order, self.slice))
+        for obj in objs:
+            model._orm_forget(obj.pk)
+            obj._orm_mark_deleted()
+
+    def _update(self, q):
+        return execute(q).rowcount
+
+    def update(self, **values):
+        if not isinstance(self.sources, ModelList) or len(self.sources) != 1:
+            raise TypeError('update requires a single model')
+        if self.group is not None:
+            raise TypeError("can't update a grouped select")
+        model = self.sources[0]
+        columns = OrderedDict()
+        for attr, value in sorted(values.iteritems()):
+            if attr == model._orm_pk_attr or attr not in model._orm_columns:
+                raise TypeError('can\'t update %r' % (attr,))
+            column = getattr(model, attr)
+            if column.adapter is not None and not hasattr(value, 'sql'):
+                value = column.adapter(value)
+            columns[column] = value
+        where = self._restricted(model)
+        objs = self._cached(model, where)
+        count = self._update(Update(model, columns, where))
+        for obj in objs:
+            for attr, value in values.iteritems():
+                if attr in obj._orm_dirty_attrs:
+                    continue
+                if hasattr(value, 'sql'):
+                    obj.__dict__.pop(attr, None)
+                else:
+                    obj.__dict__[attr] = value
+        return count
 
     def sql(self):
         sql = 'select ' + self.what.sql()
-        if self.sources is not None:
+        if isinstance(self.sources, Select):
+            sql += ' from (%s)' % (self.sources.sql(),)
+        elif self.sources is not None:
             sql += ' from ' + self.sources.sql()
         if self.where is not None:
             sql += ' where ' + self.where.sql()
+        if self.group is not None:
+            sql += ' group by ' + self.group.sql()
+        if self._having is not None:
+            sql += ' having ' + self._having.sql()
         if self.order is not None:
             sql += ' order by ' + self.order.sql()
         if self.slice is not None:
@@ -318,11 +897,28 @@ class Select(Expr):
             args.extend(self.sources.args())
         if self.where is not None:
             args.extend(self.where.args())
+        if self.group is not None:
+            args.extend(self.group.args())
+        if self._having is not None:
+            args.extend(self._having.args())
         if self.order is not None:
             args.extend(self.order.args())
         return args
 
 
+def _after(keys, obj):
+    terms = []
+    equal = []
+    for column, descending in keys:
+        value = obj._orm_get_column(column)
+        if column.adapter is not None:
+            value = column.adapter(value)
+        step = Lt(column, value) if descending else Gt(column, value)
+        terms.append(reduce(And, equal + [step]))
+        equal.append(Eq(column, value))
+    return reduce(Or, terms)
+
+
 class Delete(Expr):
     def __init__(self, sources, where=None, order=None, slice=None):
         if isinstance(sources, ExprList) and len(sources) > 1:
@@ -352,11 +948,20 @@ class Delete(Expr):
             args.extend(self.order.args())
         return args
 
+    def tables(self):
+        return _tables(self.sources)
+
 
 class Insert(Expr):
-    def __init__(self, model, values=None):
+    def __init__(self, model, values=None, conflict=None, update=None):
         self.model = model
         self.values = values
+        self.conflict = conflict
+        if conflict is not None and update is None:
+            names = set(column.name for column in conflict)
+            update = [column for column in values or ()
+                      if column.name not in names]
+        self.update = update
 
     def sql(self):
         sql = 'insert into ' + self.model._orm_table
@@ -366,6 +971,15 @@ class Insert(Expr):
                     ExprList(self.values.values()).sql())
         else:
             sql += ' default values'
+        if self.conflict is not None:
+            sql += ' on conflict (%s) do ' % (
+                ', '.join(column.name for column in self.conflict),)
+            if self.update:
+                sql += 'update set ' + ', '.join(
+                    '%s = excluded.%s' % (column.name, column.name)
+                    for column in self.update)
+            else:
+                sql += 'nothing'
         return sql
 
     def args(self):
@@ -378,6 +992,9 @@ class Insert(Expr):
                     args.append(value)
         return args
 
+    def tables(self):
+        return _tables(ModelList([self.model]))
+
 
 class Update(Expr):
     def __init__(self, model, values, where=None):
@@ -404,3 +1021,6 @@ class Update(Expr):
         if self.where is not None:
             args.extend(self.where.args())
         return args
+
+    def tables(self):
+        return _tables(ModelList([self.model]))
@@ -0,0 +1,191 @@
+from collections import OrderedDict
+
+from orm import connection
+from orm.model import Model, ToOne
+from orm.query import *
+
+
+__all__ = ['Session']
+
+
+def _references(model):
+    seen = set()
+    for cls in model.__mro__:
+        for name, value in cls.__dict__.items():
+            if isinstance(value, ToOne) and name not in seen:
+                seen.add(name)
+                value._promote_by_name()
+                yield value
+
+
+def _dependency_order(models):
+    order = []
+    visiting = set()
+
+    def visit(model):
+        if model in order or model in visiting:
+            return
+        visiting.add(model)
+        for reference in _references(model):
+            other = reference.other_column.model
+            if other in models:
+                visit(other)
+        visiting.discard(model)
+        order.append(model)
+    for model in models:
+        visit(model)
+    return order
+
+
+class Session(object):
+    def __init__(self):
+        self._objects = OrderedDict()
+        self._deleted = OrderedDict()
+        self._flushed = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        elif connection._depth():
+            self._discard()
+        else:
+            self.rollback()
+
+    def __contains__(self, obj):
+        return id(obj) in self._objects or id(obj) in self._deleted
+
+    def add(self, obj):
+        if not isinstance(obj, Model):
+            raise TypeError('object must be a model instance')
+        self._deleted.pop(id(obj), None)
+        self._objects[id(obj)] = obj
+
+    def add_all(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def delete(self, obj):
+        if not isinstance(obj, Model):
+            raise TypeError('object must be a model instance')
+        self._objects.pop(id(obj), None)
+        if not obj._orm_new_row:
+            self._deleted[id(obj)] = obj
+
+    @property
+    def new(self):
+        return [obj for obj in self._objects.values() if obj._orm_new_row]
+
+    @property
+    def dirty(self):
+        return [obj for obj in self._objects.values()
+                if not obj._orm_new_row and obj._orm_dirty_attrs]
+
+    @property
+    def deleted(self):
+        return self._deleted.values()
+
+    def _by_model(self, objs):
+        groups = OrderedDict()
+        for obj in objs:
+            groups.setdefault(type(obj), []).append(obj)
+        return groups
+
+    def flush(self):
+        for obj in self._objects.values() + self._deleted.values():
+            if id(obj) not in self._flushed:
+                self._flushed[id(obj)] = (obj, obj._orm_new_row,
+                                          obj.__dict__.get(obj._orm_pk_attr),
+                                          set(obj._orm_dirty_attrs))
+        pending = self._by_model(self._objects.values())
+        deleted = self._by_model(self._deleted.values())
+        order = _dependency_order(list(pending) + list(deleted))
+        if all(model._orm_shards is not None for model in order):
+            self._write(order, pending, deleted)
+        else:
+            with connection.atomic():
+                self._write(order, pending, deleted)
+        self._deleted.clear()
+
+    def _write(self, order, pending, deleted):
+        for model in order:
+            objs = pending.get(model, ())
+            references = list(_references(model))
+            for obj in objs:
+                for reference in references:
+                    reference._orm_resolve(obj)
+            self._insert(model, [obj for obj in objs if obj._orm_new_row])
+            self._update(model, [obj for obj in objs
+                                 if not obj._orm_new_row and
+                                 obj._orm_dirty_attrs])
+        for model in reversed(order):
+            self._delete(model, deleted.get(model, ()))
+
+    def _insert(self, model, objs):
+        groups = OrderedDict()
+        for obj in objs:
+            key = tuple(sorted(obj._orm_dirty_attrs))
+            groups.setdefault(key, []).append(obj)
+        for attrs, group in groups.iteritems():
+            model._orm_insert_many(attrs, group)
+
+    def _update(self, model, objs):
+        groups = OrderedDict()
+        for obj in objs:
+            if model._orm_pk_attr in obj._orm_dirty_attrs or \
+               model._orm_shards is not None:
+                obj.save()
+                continue
+            key = tuple(sorted(obj._orm_dirty_attrs))
+            groups.setdefault(key, []).append(obj)
+        for attrs, group in groups.iteritems():
+            q = Update(model, OrderedDict((getattr(model, attr), Sql('?'))
+                                          for attr in attrs),
+                       model.pk == Sql('?'))
+            execute_many(q, [[obj._orm_adapt_attr(attr) for attr in attrs] +
+                             [obj.pk] for obj in group])
+            for obj in group:
+                obj._orm_dirty_attrs.clear()
+                model._orm_remember(obj)
+
+    def _delete(self, model, objs):
+        if not objs:
+            return
+        if model._orm_shards is not None:
+            for obj in objs:
+                obj.delete()
+            return
+        q = Delete(Sql(model._orm_table), model.pk == Sql('?'))
+        execute_many(q, [[obj.pk] for obj in objs])
+        for obj in objs:
+            model._orm_forget(obj.pk)
+            obj._orm_mark_deleted()
+
+    def commit(self):
+        self.flush()
+        connection.commit()
+        self._flushed.clear()
+
+    def _discard(self):
+        for obj, new_row, pk, dirty in reversed(self._flushed.values()):
+            model = type(obj)
+            if not obj._orm_new_row:
+                model._orm_forget(obj.pk)
+            obj._orm_new_row = new_row
+            obj._orm_dirty_attrs.clear()
+            obj._orm_dirty_attrs.update(dirty)
+            if pk is None:
+                obj.__dict__.pop(model._orm_pk_attr, None)
+            else:
+                obj._orm_setattr(model._orm_pk_attr, pk)
+                if not new_row:
+                    model._orm_remember(obj)
+        self._flushed.clear()
+        self._objects.clear()
+        self._deleted.clear()
+
+    def rollback(self):
+        connection.rollback()
+        self._discard()
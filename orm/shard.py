@@ -0,0 +1,232 @@
+import zlib
+import heapq
+import itertools
+from contextlib import contextmanager
+
+from orm import connection
+from orm.executor import submit, in_worker
+from orm.query import *
+from orm.query import _CachedCursor
+
+
+__all__ = ['ShardRouter', 'ShardedSelect']
+
+
+def default_shard(value, count):
+    if isinstance(value, (int, long)):
+        return value % count
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return (zlib.crc32(str(value)) & 0xffffffff) % count
+
+
+class _Desc(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _fetch(conn, expr):
+    with connection.using(conn):
+        sql, args = statement_cache.compile(expr)
+        cursor = connection.cursor(readonly=True).execute(sql, args)
+        return cursor.description, cursor.fetchall()
+
+
+def _run(conn, expr):
+    with connection.using(conn):
+        return execute(expr).rowcount
+
+
+class ShardRouter(object):
+    def __init__(self, databases, key=None, shard=default_shard,
+                 pool_size=5, **kwargs):
+        if not databases:
+            raise ValueError('at least one database is required')
+        self.databases = list(databases)
+        self.key = key
+        self.shard = shard
+        self.pools = [connection.open_pool(database, pool_size=pool_size,
+                                           **kwargs)
+                      for database in self.databases]
+        for pool in self.pools:
+            connection.attach(pool)
+
+    def _key(self, model):
+        return self.key or model._orm_pk_attr
+
+    def shard_for(self, value):
+        if value is None:
+            raise ValueError('shard key must be set')
+        return self.shard(value, len(self.pools))
+
+    def index_for(self, obj):
+        cls = type(obj)
+        attr = self._key(cls)
+        index = self.shard_for(getattr(obj, attr))
+        if not obj._orm_new_row and attr in obj._orm_dirty_attrs:
+            if attr == cls._orm_pk_attr:
+                old = getattr(obj, '_orm_old_pk', None)
+            else:
+                old = obj.__dict__.get('_orm_old_key')
+            if old is not None and self.shard_for(old) != index:
+                raise ValueError("can't move a row between shards")
+        return index
+
+    @contextmanager
+    def using(self, index):
+        with connection.using(self.pools[index].connection()) as conn:
+            yield conn
+
+    def route(self, obj):
+        return self.using(self.index_for(obj))
+
+    def fan_out(self, fn, *args):
+        conns = [pool.connection() for pool in self.pools]
+        if in_worker():
+            return [fn(conn, *args) for conn in conns]
+        futures = [submit(fn, conn, *args) for conn in conns[1:]]
+        results = [fn(conns[0], *args)]
+        results.extend(future.result() for future in futures)
+        return results
+
+    def find(self, model, where=None):
+        s = ShardedSelect(ExprList(model._orm_column_objects()),
+                          ModelList([model]), where)
+        s.router = self
+        return s
+
+    def get(self, model, pk):
+        s = Select(ExprList(model._orm_column_objects()),
+                   ModelList([model]), model.pk == pk)
+        try:
+            if self._key(model) != model._orm_pk_attr:
+                return self.find(model, model.pk == pk)[0]
+            with self.using(self.shard_for(pk)):
+                return s[0]
+        except IndexError:
+            raise KeyError(pk, 'no such row')
+
+    def _each(self, method):
+        for pool in self.pools:
+            conn = pool.leased()
+            if conn is not None:
+                getattr(conn, method)()
+
+    def commit(self):
+        self._each('commit')
+
+    def rollback(self):
+        self._each('rollback')
+
+    def release(self):
+        for pool in self.pools:
+            pool.release()
+
+    def close(self):
+        for pool in self.pools:
+            connection.detach(pool)
+            pool.close()
+
+
+class ShardedSelect(Select):
+    router = None
+
+    _options = Select._options + ('router',)
+
+    def _new(self, what, sources, where, order, slice):
+        return ShardedSelect(what, sources, where, order, slice)
+
+    def _keys(self, expr):
+        what = [item.sql() for item in expr.what]
+        keys = []
+        for item in self._order_items():
+            descending = isinstance(item, Desc)
+            if isinstance(item, (Asc, Desc)):
+                item = item.value
+            try:
+                keys.append((what.index(item.sql()), descending))
+            except ValueError:
+                raise NotImplementedError(
+                    'sharded queries can only order by selected columns')
+        return keys
+
+    def _execute(self, expr=None):
+        if expr is None:
+            expr = self
+        if self.group is not None:
+            raise NotImplementedError('sharded queries cannot be grouped')
+        slc = expr.slice
+        if slc is not None:
+            expr = Select(expr.what, expr.sources, expr.where, expr.order,
+                          None if slc.stop is None else slice(slc.stop))
+        results = self.router.fan_out(_fetch, expr)
+        description = results[0][0]
+        keys = self._keys(expr)
+        if keys:
+            def decorate(index, rows):
+                for row in rows:
+                    yield (tuple(_Desc(row[i]) if descending else row[i]
+                                 for i, descending in keys), index, row)
+            rows = (row for key, index, row in heapq.merge(
+                *[decorate(index, rows)
+                  for index, (d, rows) in enumerate(results)]))
+        else:
+            rows = itertools.chain(*[rows for d, rows in results])
+        if slc is not None:
+            rows = itertools.islice(rows, slc.start, slc.stop)
+        return _CachedCursor(description, rows)
+
+    def __len__(self):
+        if self.group is not None:
+            raise NotImplementedError('sharded queries cannot be grouped')
+        s = Select(Sql('count(*)'), self.sources, self.where)
+        total = sum(rows[0][0] for d, rows in self.router.fan_out(_fetch, s))
+        if self.slice is None:
+            return total
+        return len(xrange(*self.slice.indices(total)))
+
+    def exists(self):
+        if self.slice is not None:
+            return len(self) > 0
+        s = Select(Sql('1'), self.sources, self.where, slice=slice(1))
+        return any(rows for d, rows in self.router.fan_out(_fetch, s))
+
+    def aggregate(self, **aggregates):
+        raise NotImplementedError('sharded queries cannot be aggregated')
+
+    def iter_chunks(self, size):
+        raise NotImplementedError('sharded queries cannot be chunked')
+
+    def delete(self):
+        if self.slice is not None or self.order is not None:
+            raise NotImplementedError(
+                'sharded deletes cannot be ordered or sliced')
+        super(ShardedSelect, self).delete()
+
+    def _delete(self, q):
+        self.router.fan_out(_run, q)
+
+    def _affected(self, model, where):
+        s = Select(model.pk, self.sources, where)
+        return [row[0] for d, rows in self.router.fan_out(_fetch, s)
+                for row in rows]
+
+    def _update(self, q):
+        return sum(self.router.fan_out(_run, q))
+
+    def update(self, **values):
+        if self.slice is not None or self.order is not None:
+            raise NotImplementedError(
+                'sharded updates cannot be ordered or sliced')
+        return super(ShardedSelect, self).update(**values)
@@ -3,10 +3,7 @@ def slice2limit(slc):
         raise TypeError('step argument in slice is not supported')
     if slc.stop is None and slc.start is None:
         return
-    if (
-        slc.stop is not None and slc.stop < 0) or (
-        slc.start is not None and slc.start < 0
-    ):
+    if is_negative(slc):
         raise NotImplementedError('negative slice values not yet supported')
     if slc.start is None:
         return 'limit %d' % (slc.stop,)
@@ -18,3 +15,24 @@ def slice2limit(slc):
     else:
         limit += ', %d' % (slc.stop - slc.start,)
     return limit
+
+
+def is_negative(slc):
+    return (
+        slc.stop is not None and slc.stop < 0) or (
+        slc.start is not None and slc.start < 0)
+
+
+def reverse_slice(slc):
+    if slc.step is not None:
+        raise TypeError('step argument in slice is not supported')
+    if (
+        slc.stop is not None and slc.stop >= 0) or (
+        slc.start is not None and slc.start >= 0
+    ):
+        raise NotImplementedError(
+            'mixed positive and negative slice values not yet supported')
+    start = 0 if slc.stop is None else -slc.stop
+    if slc.start is None:
+        return slice(start, None)
+    return slice(start, max(start, -slc.start))
@@ -0,0 +1,22 @@
+from orm import connection
+
+
+class recording(object):
+    def __init__(self):
+        self.executions = []
+
+    def _executed(self, sql, args, elapsed):
+        self.executions.append(sql)
+
+    def __enter__(self):
+        connection.on_execute(self._executed)
+        return self.executions
+
+    def __exit__(self, *exc_info):
+        connection.remove_hook(self._executed)
+
+
+class no_queries(recording):
+    def __exit__(self, *exc_info):
+        recording.__exit__(self, *exc_info)
+        assert not self.executions, self.executions
@@ -0,0 +1,50 @@
+from nose.tools import assert_raises
+
+from orm.cache import LRUCache
+
+
+def test_get_missing_returns_default():
+    cache = LRUCache(2)
+    assert cache.get('a') is None
+    assert cache.get('a', 1) == 1
+    assert cache.misses == 2, cache.misses
+
+
+def test_put_and_get():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    assert cache.hits == 1, cache.hits
+    assert 'a' in cache
+    assert len(cache) == 1, len(cache)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.evictions == 1, cache.evictions
+
+
+def test_expired_entries_miss():
+    cache = LRUCache(2, ttl=-1)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+    assert cache.evictions == 1, cache.evictions
+
+
+def test_hit_ratio():
+    cache = LRUCache(2)
+    assert cache.hit_ratio == 0.0
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    assert cache.hit_ratio == 0.5, cache.hit_ratio
+
+
+def test_zero_maxsize_raises_valueerror():
+    assert_raises(ValueError, LRUCache, 0)
@@ -0,0 +1,361 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from nose.tools import assert_raises, with_setup
+
+import orm
+from orm import connection
+
+
+def make_pool(size=2, **kwargs):
+    return connection.Pool(
+        lambda: sqlite3.connect(':memory:', check_same_thread=False),
+        size, **kwargs)
+
+
+def test_connection_is_bound_to_thread():
+    pool = make_pool()
+    assert pool.connection() is pool.connection()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not pool.connection()
+    assert pool.checkouts == 2, pool.checkouts
+
+
+def test_release_returns_connection_to_pool():
+    pool = make_pool()
+    conn = pool.connection()
+    assert pool.idle == 0, pool.idle
+    pool.release()
+    assert pool.idle == 1, pool.idle
+    assert pool.connection() is conn
+
+
+def test_finished_threads_return_their_connections():
+    pool = make_pool()
+    thread = threading.Thread(target=pool.connection)
+    thread.start()
+    thread.join()
+    for i in range(100):
+        if pool.idle:
+            break
+        time.sleep(0.01)
+    assert pool.idle == 1, pool.idle
+
+
+def test_checkout_waits_when_exhausted():
+    pool = make_pool(1, timeout=0.01)
+    conn = pool.checkout()
+    assert_raises(RuntimeError, pool.checkout)
+    assert pool.waits == 1, pool.waits
+    pool.checkin(conn)
+    assert pool.checkout() is conn
+
+
+def test_pragmas_applied_on_connect():
+    pool = make_pool(pragmas=[('user_version', 7)])
+    conn = pool.checkout()
+    version = conn.execute('pragma user_version').fetchone()[0]
+    assert version == 7, version
+
+
+def test_stats():
+    pool = make_pool()
+    pool.connection()
+    pool.release()
+    stats = pool.stats()
+    assert stats == dict(size=2, opened=1, idle=1, checkouts=1, waits=0), \
+        stats
+
+
+def test_cursor_without_connection_raises_runtimeerror():
+    connection.close()
+    assert_raises(RuntimeError, connection.cursor)
+
+
+def test_connection_override_takes_precedence():
+    connection.connect(':memory:')
+    try:
+        conn = sqlite3.connect(':memory:')
+        connection.connection = conn
+        assert connection._current() is conn
+    finally:
+        connection.close()
+
+
+def values():
+    return [row[0] for row in connection.cursor().execute(
+        'select a from t order by a')]
+
+
+def setup_table():
+    connection.connect(':memory:')
+    connection.cursor().execute('create table t (a)')
+
+
+@with_setup(setup_table, connection.close)
+def test_transaction_commits():
+    with orm.transaction():
+        connection.cursor().execute('insert into t values (1)')
+        connection.commit()
+    connection.rollback()
+    assert values() == [1], values()
+
+
+@with_setup(setup_table, connection.close)
+def test_transaction_rolls_back_on_error():
+    def fail():
+        with orm.transaction():
+            connection.cursor().execute('insert into t values (1)')
+            raise ValueError()
+    assert_raises(ValueError, fail)
+    assert values() == [], values()
+
+
+@with_setup(setup_table, connection.close)
+def test_nested_savepoint_rolls_back_alone():
+    def fail():
+        with orm.savepoint():
+            connection.cursor().execute('insert into t values (2)')
+            raise ValueError()
+    with orm.transaction():
+        connection.cursor().execute('insert into t values (1)')
+        assert_raises(ValueError, fail)
+    assert values() == [1], values()
+
+
+@with_setup(setup_table, connection.close)
+def test_rollback_inside_scope_raises_runtimeerror():
+    with orm.transaction():
+        assert_raises(RuntimeError, connection.rollback)
+
+
+def test_group_commit_syncs_every_nth_commit():
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path, profile='durable')
+    connection.cursor().execute('create table t (x int)')
+    connection.commit()
+    connection.group_commit(max_commits=3)
+    try:
+        levels = []
+        for i in range(7):
+            connection.cursor().execute('insert into t values (?)', [i])
+            connection.commit()
+            levels.append(pragma('synchronous'))
+        assert levels == [1, 2, 1, 1, 2, 1, 1], levels
+        connection.group_commit()
+        connection.cursor().execute('insert into t values (7)')
+        connection.commit()
+        assert pragma('synchronous') == 2, pragma('synchronous')
+    finally:
+        connection.group_commit()
+        connection.close()
+        os.unlink(path)
+
+
+def test_group_commit_does_not_hold_the_write_lock():
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path, timeout=0.5, pool_size=2)
+    connection.cursor().execute('create table t (x int)')
+    connection.commit()
+    connection.release()
+    connection.group_commit(max_commits=10)
+    committed, done = threading.Event(), threading.Event()
+    def idle():
+        connection.cursor().execute('insert into t values (1)')
+        connection.commit()
+        committed.set()
+        done.wait(5)
+        connection.release()
+    thread = threading.Thread(target=idle)
+    thread.start()
+    try:
+        committed.wait(5)
+        connection.cursor().execute('insert into t values (2)')
+        connection.commit()
+        count = connection.cursor().execute(
+            'select count(*) from t').fetchone()[0]
+        assert count == 2, count
+    finally:
+        done.set()
+        thread.join()
+        connection.group_commit()
+        connection.close()
+        os.unlink(path)
+
+
+def pragma(name):
+    return connection.cursor().execute('pragma ' + name).fetchone()[0]
+
+
+def test_connect_applies_profile():
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path, profile='durable', pragmas={'cache_size': -100})
+    try:
+        assert pragma('journal_mode') == 'wal', pragma('journal_mode')
+        assert pragma('synchronous') == 2, pragma('synchronous')
+        assert pragma('cache_size') == -100, pragma('cache_size')
+    finally:
+        connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def test_connect_rejects_unknown_profile():
+    assert_raises(ValueError, connection.connect, ':memory:', profile='fast')
+
+
+def test_bulk_load_restores_pragmas():
+    connection.connect(':memory:', profile='durable')
+    try:
+        with connection.bulk_load():
+            assert pragma('synchronous') == 0, pragma('synchronous')
+            assert pragma('cache_size') == -262144, pragma('cache_size')
+        assert pragma('synchronous') == 2, pragma('synchronous')
+        assert pragma('cache_size') == -16384, pragma('cache_size')
+    finally:
+        connection.close()
+
+
+def test_reads_are_routed_to_read_only_connections():
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path, profile='read-heavy', read_pool_size=2)
+    try:
+        connection.cursor().execute('create table t (x int)')
+        connection.commit()
+        connection.cursor().execute('insert into t values (1)')
+        reader = connection.cursor(readonly=True)
+        assert reader.execute('select count(*) from t').fetchone()[0] == 1
+        assert connection.read_pool.checkouts == 0
+        connection.commit()
+        reader = connection.cursor(readonly=True)
+        assert reader.execute('select count(*) from t').fetchone()[0] == 1
+        assert connection.read_pool.checkouts == 1
+        assert_raises(sqlite3.OperationalError, reader.execute,
+                      'insert into t values (2)')
+        with connection.transaction():
+            connection.cursor(readonly=True)
+            assert connection.read_pool.checkouts == 1
+        connection.release()
+        assert connection.read_pool.idle == 1, connection.read_pool.idle
+    finally:
+        connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def test_exhausted_pool_raises_after_pool_timeout():
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path, pool_size=1, pool_timeout=0.05)
+    leased, done = threading.Event(), threading.Event()
+    def hold():
+        connection.cursor()
+        leased.set()
+        done.wait()
+        connection.release()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    try:
+        leased.wait()
+        assert_raises(RuntimeError, connection.cursor)
+        assert connection.pool.waits == 1, connection.pool.waits
+    finally:
+        done.set()
+        thread.join()
+        connection.close()
+        os.unlink(path)
+
+
+def test_result_cache_is_invalidated_on_commit():
+    from orm.model import Model, Column
+
+    class Entry(Model):
+        _orm_table = 'entry'
+        name = Column()
+
+    path = tempfile.mktemp(suffix='.sqlite')
+    connection.connect(path)
+    try:
+        Entry.create_table()
+        connection.commit()
+        entries = Entry.find(Entry.name == 'x').cache()
+        Entry.insert_many([dict(name='x')])
+        thread = threading.Thread(target=lambda: (len(entries),
+                                                  connection.release()))
+        thread.start()
+        thread.join()
+        connection.commit()
+        assert len(entries) == 1, len(entries)
+    finally:
+        connection.close()
+        os.unlink(path)
+
+
+def test_group_commit_work_survives_release_and_thread_exit():
+    path = tempfile.mktemp(suffix='.sqlite')
+    def count():
+        connection.connect(path)
+        try:
+            return connection.cursor().execute(
+                'select count(*) from t').fetchone()[0]
+        finally:
+            connection.close()
+    connection.connect(path)
+    connection.cursor().execute('create table t (x int)')
+    connection.commit()
+    connection.group_commit(max_commits=10)
+    try:
+        def insert():
+            connection.cursor().execute('insert into t values (1)')
+            connection.commit()
+        thread = threading.Thread(target=insert)
+        thread.start()
+        thread.join()
+        for i in range(100):
+            if connection.pool.idle:
+                break
+            time.sleep(0.01)
+        insert()
+        connection.close()
+        assert count() == 2, count()
+    finally:
+        connection.group_commit()
+        os.unlink(path)
+
+
+def test_read_pool_forces_wal_and_a_single_writer():
+    path = tempfile.mktemp(suffix='.sqlite')
+    assert_raises(ValueError, connection.connect, path, read_pool_size=1,
+                  pragmas={'journal_mode': 'delete'})
+    connection.connect(path, read_pool_size=1)
+    try:
+        assert pragma('journal_mode') == 'wal', pragma('journal_mode')
+        assert connection.pool.size == 1, connection.pool.size
+        connection.cursor().execute('create table t (x int)')
+        connection.commit()
+        connection.release()
+        def write(x):
+            connection.cursor().execute('insert into t values (?)', (x,))
+            connection.commit()
+            connection.release()
+        threads = [threading.Thread(target=write, args=(x,))
+                   for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert connection.cursor().execute(
+            'select count(*) from t').fetchone()[0] == 4
+        assert connection.pool.opened == 1, connection.pool.opened
+    finally:
+        connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
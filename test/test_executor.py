@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+from nose.tools import assert_raises
+
+from orm import connection
+from orm.executor import *
+
+
+def test_submit_returns_result():
+    executor = Executor(1)
+    try:
+        future = executor.submit(lambda a, b=0: a + b, 1, b=2)
+        assert future.result(1) == 3
+        assert future.done()
+        assert future.exception() is None
+    finally:
+        executor.shutdown()
+
+
+def test_exceptions_are_reraised():
+    def fail():
+        raise KeyError('x')
+    executor = Executor(1)
+    try:
+        future = executor.submit(fail)
+        assert_raises(KeyError, future.result, 1)
+        assert isinstance(future.exception(), KeyError)
+    finally:
+        executor.shutdown()
+
+
+def test_done_callbacks():
+    called = []
+    executor = Executor(1)
+    try:
+        future = executor.submit(lambda: 1)
+        future.result(1)
+        future.add_done_callback(called.append)
+        assert called == [future], called
+    finally:
+        executor.shutdown()
+
+
+def test_workers_use_their_own_connections():
+    pool = connection.Pool(
+        lambda: sqlite3.connect(':memory:', check_same_thread=False), 3)
+    leased = []
+    both = threading.Event()
+    def lease():
+        leased.append(pool.connection())
+        if len(leased) == 2:
+            both.set()
+        both.wait(1)
+        return pool.connection()
+    executor = Executor(2)
+    try:
+        futures = [executor.submit(lease) for i in range(2)]
+        conns = [f.result(1) for f in futures]
+        assert conns[0] is not conns[1]
+    finally:
+        executor.shutdown()
+
+
+def test_submit_after_shutdown_raises_runtimeerror():
+    executor = Executor(1)
+    executor.shutdown()
+    assert_raises(RuntimeError, executor.submit, lambda: None)
+
+
+def test_workers_return_connections_after_each_task():
+    connection.connect(':memory:')
+    executor = Executor(1)
+    try:
+        executor.submit(connection.cursor).result(1)
+        assert connection.pool.idle == 1, connection.pool.idle
+    finally:
+        executor.shutdown()
+        connection.close()
+
+
+def test_failing_release_still_finishes_the_future():
+    def release():
+        raise sqlite3.OperationalError('database is locked')
+    original, connection.release = connection.release, release
+    executor = Executor(1)
+    try:
+        future = executor.submit(lambda: 1)
+        assert_raises(sqlite3.OperationalError, future.result, 1)
+        connection.release = original
+        assert executor.submit(lambda: 2).result(1) == 2
+    finally:
+        connection.release = original
+        executor.shutdown()
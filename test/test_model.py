@@ -0,0 +1,594 @@
+from nose.tools import assert_raises
+
+from orm import connection
+from orm.model import *
+from orm.query import Desc, Sum, Count, FullScanError, strict
+
+from helpers import recording, no_queries
+
+
+class Person(Model):
+    _orm_table = 'person'
+    name = Column()
+    age = Column()
+
+
+class Pet(Model):
+    _orm_table = 'pet'
+    name = Column()
+    owner_id = Column('owner')
+    owner = ToOne(owner_id, 'Person.pk')
+
+
+Person.pets = ToMany(Person.pk, Pet.owner_id)
+
+
+class Tag(Model):
+    _orm_table = 'tag'
+    label = Column()
+
+
+class PetTag(Model):
+    _orm_table = 'pet_tag'
+    pet_id = Column('pet')
+    tag_id = Column('tag')
+
+
+Pet.tags = ManyToMany(Pet.pk, PetTag.pet_id, PetTag.tag_id, Tag.pk)
+
+
+class Visit(Model):
+    _orm_table = 'visit'
+    _orm_cache_size = 2
+    page = Column()
+
+
+class Document(Model):
+    _orm_table = 'document'
+    title = Column()
+    author = Column()
+    body = Column(group='text')
+    summary = Column(group='text')
+
+
+def setup():
+    connection.connect(':memory:')
+    connection.cursor().execute(
+        'create table person (name text, age integer)')
+    connection.cursor().execute(
+        'create table pet (name text, owner integer)')
+    connection.cursor().execute('create table visit (page text)')
+    connection.cursor().execute('create table tag (label text)')
+    connection.cursor().execute(
+        'create table pet_tag (pet integer, tag integer)')
+    connection.cursor().execute(
+        'create table document (title text, author text, '
+        'body text, summary text)')
+
+
+def teardown():
+    connection.close()
+
+
+def make_person(name, age=None):
+    person = Person()
+    person.name = name
+    if age is not None:
+        person.age = age
+    return person
+
+
+def test_save_many_assigns_rowids():
+    people = [make_person('a', 1), make_person('b'), make_person('c', 3)]
+    Person.save_many(people)
+    for person in people:
+        assert not person._orm_new_row
+        assert not person._orm_dirty_attrs, person._orm_dirty_attrs
+        assert Person._orm_obj_cache[person.pk] is person
+        row = connection.cursor().execute(
+            'select name from person where rowid = ?',
+            [person.pk]).fetchone()
+        assert row[0] == person.name, (row, person.name)
+
+
+def test_save_many_is_atomic_in_autocommit_mode():
+    conn = connection._current()
+    conn.isolation_level = None
+    try:
+        people = [make_person('atomic'), make_person(object())]
+        assert_raises(Exception, Person.save_many, people)
+    finally:
+        conn.isolation_level = ''
+    assert not len(Person.find(Person.name == 'atomic'))
+
+
+def test_save_many_uses_one_statement_per_column_set():
+    with recording() as executions:
+        Person.save_many([make_person(str(i), i % 2 or None)
+                          for i in range(10)])
+    inserts = [sql for sql in executions if sql.startswith('insert')]
+    assert len(inserts) == 2, executions
+
+
+def test_save_many_rejects_other_models():
+    assert_raises(TypeError, Person.save_many, [object()])
+
+
+def test_insert_many():
+    people = Person.insert_many([dict(name='x', age=5), dict(name='y')])
+    assert [p.name for p in people] == ['x', 'y']
+    assert Person.get(people[0].pk).age == 5
+
+
+def make_pets():
+    owners = Person.insert_many([dict(name='o1'), dict(name='o2')])
+    pets = []
+    for i in range(4):
+        pet = Pet()
+        pet.name = 'pet%d' % (i,)
+        pet.owner = owners[i % 2]
+        pets.append(pet)
+    Pet.save_many(pets)
+    return [owner.pk for owner in owners], [pet.pk for pet in pets]
+
+
+def test_select_related_loads_references_up_front():
+    owner_pks, pks = make_pets()
+    pets = list(Pet.find(Pet.pk.is_in(pks)).select_related(Pet.owner))
+    with no_queries():
+        owners = [pet.owner.name for pet in pets]
+    assert owners == ['o1', 'o2', 'o1', 'o2'], owners
+
+
+def test_select_related_with_unrelated_reference_raises_typeerror():
+    assert_raises(TypeError, Person.find().select_related, Pet.owner)
+
+
+def test_select_related_and_prefetch_reject_the_other_kind():
+    assert_raises(TypeError, Person.find().select_related, Person.pets)
+    assert_raises(TypeError, Pet.find().prefetch, Pet.owner)
+
+
+def test_prefetch_loads_collections_up_front():
+    owner_pks, pks = make_pets()
+    owners = list(Person.find(Person.pk.is_in(owner_pks))
+                  .order_by(Person.pk).prefetch(Person.pets))
+    with no_queries():
+        names = [sorted(pet.name for pet in owner.pets) for owner in owners]
+        counts = [len(owner.pets) for owner in owners]
+    assert names == [['pet0', 'pet2'], ['pet1', 'pet3']], names
+    assert counts == [2, 2], counts
+
+
+def test_prefetched_collections_are_dropped_on_reload():
+    owner = Person.insert_many([dict(name='stale')])[0]
+    Pet.insert_many([dict(name='p1', owner_id=owner.pk)])
+    list(Person.find(Person.pk == owner.pk).prefetch(Person.pets))
+    Pet.insert_many([dict(name='p2', owner_id=owner.pk)])
+    owner = list(Person.find(Person.pk == owner.pk))[0]
+    assert sorted(pet.name for pet in owner.pets) == ['p1', 'p2']
+
+
+def test_to_many_find_index_and_slice():
+    owner_pks, pks = make_pets()
+    owner = Person.get(owner_pks[0])
+    assert [pet.name for pet in owner.pets.find(Pet.name == 'pet2')] == [
+        'pet2']
+    ordered = owner.pets.order_by(Desc(Pet.name))
+    assert [pet.name for pet in ordered] == ['pet2', 'pet0']
+    assert owner.pets[0].name == 'pet0'
+    assert owner.pets[-1].name == 'pet2'
+    assert [pet.name for pet in owner.pets[0:2]] == ['pet0', 'pet2']
+
+
+def test_many_to_many_find():
+    pet = Pet.insert_many([dict(name='tagged')])[0]
+    tags = Tag.insert_many([dict(label='a'), dict(label='b')])
+    for tag in tags:
+        pet.tags.add(tag)
+    assert sorted(tag.label for tag in pet.tags) == ['a', 'b']
+    assert [tag.label for tag in pet.tags.find(Tag.label == 'b')] == ['b']
+    assert pet.tags[0].label in ('a', 'b')
+
+
+def test_prefetched_collections_are_dropped_on_child_writes():
+    owner = Person.insert_many([dict(name='fresh')])[0]
+    list(Person.find(Person.pk == owner.pk).prefetch(Person.pets))
+    with no_queries():
+        assert len(owner.pets) == 0
+    pet = Pet()
+    pet.name, pet.owner = 'new', owner
+    pet.save()
+    assert len(Person.get(owner.pk).pets) == 1
+    list(Person.find(Person.pk == owner.pk).prefetch(Person.pets))
+    Pet.find(Pet.owner_id == owner.pk).delete()
+    assert len(Person.get(owner.pk).pets) == 0
+
+
+def make_document():
+    doc = Document()
+    doc.title = 'title'
+    doc.author = 'author'
+    doc.body = 'body'
+    doc.summary = 'summary'
+    doc.save()
+    return doc.pk
+
+
+def test_grouped_columns_are_deferred():
+    pk = make_document()
+    doc = Document.find(Document.pk == pk)[0]
+    assert 'title' in doc.__dict__
+    assert 'body' not in doc.__dict__
+    with recording() as executions:
+        assert doc.body == 'body', doc.body
+        assert doc.summary == 'summary', doc.summary
+    assert len(executions) == 1, executions
+
+
+def test_reload_loads_missing_columns_in_one_query():
+    doc = Document.get(make_document())
+    doc.reload()
+    with recording() as executions:
+        assert doc.title == 'title', doc.title
+        assert doc.author == 'author', doc.author
+    assert len(executions) == 1, executions
+    assert 'body' not in doc.__dict__
+
+
+def test_orm_load_reuses_hydration_plan():
+    description = (('rowid',), ('name',), ('extra',))
+    first = Person._orm_load((1000, 'n', 'x'), description)
+    plans = len(Person._orm_plans)
+    second = Person._orm_load((1001, 'm', 'y'), description)
+    assert len(Person._orm_plans) == plans, Person._orm_plans
+    assert (first.pk, first.name, first.extra) == (1000, 'n', 'x')
+    assert (second.pk, second.name, second.extra) == (1001, 'm', 'y')
+
+
+def test_orm_load_without_primary_key_raises_typeerror():
+    assert_raises(TypeError, Person._orm_load, ('n',), (('name',),))
+
+
+def test_iter_chunks_pages_by_key():
+    Person.insert_many([dict(name='chunk', age=i % 4) for i in range(10)])
+    people = Person.find(Person.name == 'chunk').order_by(Desc(Person.age))
+    expected = [(p.age, p.pk) for p in people]
+    with recording() as executions:
+        chunks = list(people.iter_chunks(3))
+    assert [len(c) for c in chunks] == [3, 3, 3, 1], chunks
+    result = [(p.age, p.pk) for chunk in chunks for p in chunk]
+    assert result == sorted(expected, key=lambda (a, pk): (-a, pk)), result
+    assert all('limit 3' in sql and ',' not in sql.split('limit')[1]
+               for sql in executions), executions
+
+
+def test_iter_chunks_with_slice_raises_typeerror():
+    assert_raises(TypeError, Person.find()[1:2].iter_chunks(1).next)
+
+
+def test_cached_select_reuses_results_until_write():
+    Person.insert_many([dict(name='cached', age=1)])
+    people = Person.find(Person.name == 'cached').cache()
+    with recording() as executions:
+        assert [p.age for p in people] == [1]
+        assert [p.age for p in people] == [1]
+        assert len(people) == 1
+        assert len(people) == 1
+    assert len(executions) == 2, executions
+    person = list(people)[0]
+    person.age = 2
+    person.save()
+    assert [p.age for p in people] == [2]
+    Person.find(Person.name == 'cached').delete()
+    assert list(people) == []
+
+
+def test_lru_keeps_recent_instances_alive():
+    pks = [visit.pk for visit in
+           Visit.insert_many([dict(page=str(i)) for i in range(3)])]
+    stats = Visit.cache_stats()
+    assert stats['size'] == 2, stats
+    assert stats['evictions'] == 1, stats
+    with no_queries():
+        assert Visit.get(pks[2]).page == '2'
+        assert Visit.get(pks[1]).page == '1'
+    assert Visit.get(pks[0]).page == '0'
+    stats = Visit.cache_stats()
+    assert stats['hits'] == 2, stats
+    assert stats['evictions'] == 2, stats
+
+
+def test_delete_evicts_from_lru():
+    visit = Visit.insert_many([dict(page='gone')])[0]
+    pk = visit.pk
+    visit.delete()
+    del visit
+    assert_raises(KeyError, Visit.get, pk)
+
+
+def test_select_delete_evicts_cached_instances():
+    visit = Visit.insert_many([dict(page='ghost')])[0]
+    pk = visit.pk
+    Visit.find(Visit.page == 'ghost').delete()
+    assert visit._orm_new_row
+    del visit
+    assert_raises(KeyError, Visit.get, pk)
+
+
+def test_many_to_many_clear_evicts_links():
+    pet = Pet.insert_many([dict(name='untagged')])[0]
+    tag = Tag.insert_many([dict(label='c')])[0]
+    pet.tags.add(tag)
+    link = PetTag.find(PetTag.pet_id == pet.pk)[0]
+    pk = link.pk
+    pet.tags.clear()
+    assert link._orm_new_row
+    assert_raises(KeyError, PetTag.get, pk)
+    assert list(pet.tags) == []
+
+
+class Score(Model):
+    _orm_table = 'score'
+    player = Column()
+    points = Column(converter=int)
+
+
+def test_values_returns_converted_tuples():
+    connection.cursor().execute('create table score (player, points)')
+    Score.insert_many([dict(player='a', points='1'),
+                       dict(player='b', points='2')])
+    rows = list(Score.find().values(Score.player, Score.points))
+    assert rows == [(u'a', 1), (u'b', 2)], rows
+    rows = list(Score.find().order_by(Score.player).namedtuples())
+    assert [(r.player, r.points) for r in rows] == [(u'a', 1), (u'b', 2)]
+    assert all(isinstance(r.pk, (int, long)) for r in rows), rows
+    rows = list(Score.find().values(Score.points).tuples()[-1:])
+    assert rows == [(2,)], rows
+    assert len(Score._orm_plans) == 0, 'rows were hydrated'
+
+
+def test_aggregate_and_group_by():
+    connection.cursor().execute('create table sale (region, amount)')
+    class Sale(Model):
+        _orm_table = 'sale'
+        region = Column()
+        amount = Column()
+    Sale.insert_many([dict(region=r, amount=a)
+                      for r, a in [('n', 1), ('n', 2), ('s', 5)]])
+    result = Sale.find().aggregate(total=Sum(Sale.amount), n=Count())
+    assert result == dict(total=8, n=3), result
+    rows = list(Sale.find().group_by(Sale.region)
+                .annotate(total=Sum(Sale.amount))
+                .having(Sum(Sale.amount) > 1).order_by(Sale.region))
+    assert [(r.region, r.total) for r in rows] == [('n', 3), ('s', 5)], rows
+    grouped = Sale.find().group_by(Sale.region).having(
+        Sum(Sale.amount) > 100)
+    assert list(grouped) == [] and len(grouped) == 0
+    assert not grouped.exists()
+    first = Sale.find().order_by(Desc(Sale.amount))[0:1]
+    assert first.aggregate(total=Sum(Sale.amount)) == dict(total=5)
+
+
+class Shelf(Model):
+    _orm_table = 'shelf'
+    id = Column(primary=True)
+    label = Column(type='text', unique=True)
+    room = Column(index=True)
+    floor = Column()
+    by_floor = Index('floor', 'room', name='shelf_floor')
+
+
+class Item(Model):
+    _orm_table = 'item'
+    name = Column()
+    shelf_id = Column('shelf', type='integer')
+
+
+Shelf.items = ToMany(Shelf.id, Item.shelf_id)
+
+
+class Ordered(Model):
+    _orm_table = 'ordered'
+    id = Column(primary=True)
+    a = Column(type='text')
+    b = Column(type='text')
+    c = Column()
+    d = Column()
+    zeta = Column()
+    alpha = Column()
+
+
+def test_create_table_keeps_declaration_order():
+    Ordered.create_table()
+    sql = connection.cursor().execute(
+        "select sql from sqlite_master where name = 'ordered'").fetchone()[0]
+    assert sql == ('CREATE TABLE "ordered" (id integer primary key, '
+                   'a text, b text, c, d, zeta, alpha)'), sql
+
+
+def test_create_table_and_indexes():
+    Shelf.create_table()
+    Shelf.create_indexes()
+    sql = connection.cursor().execute(
+        "select sql from sqlite_master where name = 'shelf'").fetchone()[0]
+    assert sql == ('CREATE TABLE "shelf" (id integer primary key, '
+                   'label text, room, floor)'), sql
+    indexes = sorted(row[0] for row in connection.cursor().execute(
+        "select name from sqlite_master where type = 'index' "
+        "and tbl_name = 'shelf'"))
+    assert indexes == ['ix_shelf_label', 'ix_shelf_room', 'shelf_floor'], \
+        indexes
+    shelf = Shelf()
+    shelf.label = 'a'
+    shelf.save()
+    assert shelf.id == Shelf.get(shelf.id).id
+
+
+def test_suggested_indexes_cover_reference_targets():
+    suggested = Item.suggested_indexes()
+    assert [index.column_names(Item) for index in suggested] == [['shelf']], \
+        suggested
+    Item.create_table()
+    Item.create_indexes(suggested=True)
+    plan = connection.cursor().execute(
+        'explain query plan select * from item where shelf = 1').fetchall()
+    assert 'ix_item_shelf' in plan[0][-1], plan
+
+
+def test_explain_returns_plan_rows():
+    plan = Person.find(Person.name == 'x').explain()
+    assert plan[0].detail.startswith('SCAN'), plan
+
+
+def test_strict_mode_raises_on_full_scans():
+    strict('raise')
+    try:
+        assert_raises(FullScanError, list, Person.find(Person.name == 'x'))
+        assert_raises(FullScanError, len, Person.find(Person.name == 'x'))
+        list(Person.find(Person.pk == 1))
+        list(Person.find())
+    finally:
+        strict(None)
+
+
+class Tally(Model):
+    _orm_table = 'tally'
+    name = Column(unique=True)
+    hits = Column()
+
+
+def test_save_upsert_updates_existing_row():
+    Tally.create_table()
+    Tally.create_indexes()
+    first = Tally()
+    first.name, first.hits = 'home', 1
+    first.save(upsert=True)
+    again = Tally()
+    again.name, again.hits = 'home', 5
+    again.save(upsert=True)
+    assert again.pk == first.pk, (again.pk, first.pk)
+    assert first.hits == 5, first.hits
+    assert not again._orm_dirty_attrs and not again._orm_new_row
+    assert len(Tally.find()) == 1
+
+
+def test_upsert_many_recovers_primary_keys():
+    Tally.create_table()
+    Tally.create_indexes()
+    existing = Tally.upsert_many([dict(name='about', hits=1)])[0]
+    objs = Tally.upsert_many([dict(name='about', hits=7),
+                              dict(name='contact', hits=2)])
+    assert objs[0].pk == existing.pk, (objs[0].pk, existing.pk)
+    assert existing.hits == 7, existing.hits
+    assert objs[1].pk is not None
+    assert sorted(Tally.find().values(Tally.name, Tally.hits))[:2] == [
+        (u'about', 7), (u'contact', 2)]
+
+
+def test_upsert_requires_unique_key():
+    score = Score()
+    score.player = 'x'
+    assert_raises(TypeError, score.save, upsert=True)
+
+
+class PageView(Model):
+    _orm_table = 'page_view'
+    page = Column()
+    day = Column(type='integer')
+    hits = Column()
+    by_day = Index('page', 'day', unique=True)
+
+
+def test_upsert_many_looks_up_keys_in_one_query():
+    PageView.create_table()
+    PageView.create_indexes()
+    PageView.upsert_many([dict(page='a', day=1, hits=1)])
+    with recording() as executions:
+        objs = PageView.upsert_many([dict(page='a', day=i, hits=i)
+                                  for i in range(1, 51)])
+    selects = [sql for sql in executions if sql.startswith('select')]
+    assert len(selects) == 1, selects
+    assert [obj.day for obj in objs] == range(1, 51)
+    assert len(set(obj.pk for obj in objs)) == 50
+
+
+def test_upsert_many_matches_keys_with_column_affinity():
+    PageView.create_table()
+    PageView.create_indexes()
+    first = PageView.upsert_many([dict(page='b', day=3, hits=1)])[0]
+    again = PageView.upsert_many([dict(page='b', day='3', hits=2)])[0]
+    assert again is first, (again.pk, first.pk)
+    assert not again._orm_new_row
+    assert first.hits == 2, first.hits
+
+
+def test_upsert_many_inserts_rows_with_null_keys():
+    PageView.create_table()
+    PageView.create_indexes()
+    objs = PageView.upsert_many([dict(page='n', day=None, hits=1),
+                                 dict(page='n', day=None, hits=2),
+                                 dict(page='n', day=1, hits=3)])
+    assert len(set(obj.pk for obj in objs)) == 3
+    assert all(obj.pk is not None for obj in objs)
+    assert [PageView.get(obj.pk).hits for obj in objs] == [1, 2, 3]
+    view = PageView()
+    view.page, view.day, view.hits = 'n', None, 4
+    view.save(upsert=True)
+    assert view.pk not in [obj.pk for obj in objs]
+    assert len(PageView.find(PageView.page == 'n')) == 4
+
+
+def test_upsert_merges_into_cached_instance():
+    Tally.create_table()
+    Tally.create_indexes()
+    first = Tally()
+    first.name, first.hits = 'faq', 1
+    first.save(upsert=True)
+    again = Tally()
+    again.name, again.hits = 'faq', 3
+    again.save(upsert=True)
+    assert Tally.get(first.pk) is first
+    assert Tally.upsert_many([dict(name='faq', hits=4)])[0] is first
+    assert first.hits == 4, first.hits
+
+
+def test_select_update_runs_one_statement():
+    Score.insert_many([dict(player='p%d' % i, points=i) for i in range(5)])
+    with recording() as executions:
+        count = Score.find(Score.points < 3).update(player='low')
+    assert count == 3, count
+    assert len(executions) == 1, executions
+    assert executions[0].startswith('update score set'), executions
+    assert sorted(Score.find(Score.player == 'low').values(Score.points)) == [
+        (0,), (1,), (2,)]
+
+
+def test_select_update_patches_cached_instances():
+    scores = Score.insert_many([dict(player='q%d' % i, points=i)
+                                for i in range(5)])
+    s = Score.find(Score.player.is_in(['q0', 'q1', 'q2', 'q3', 'q4']))
+    s.order_by(Desc(Score.points))[:2].update(player='top',
+                                              points=Score.points + 10)
+    assert [score.player for score in scores] == [
+        'q0', 'q1', 'q2', 'top', 'top'], [score.player for score in scores]
+    with recording() as executions:
+        assert scores[4].points == 14, scores[4].points
+    assert len(executions) == 1, executions
+    assert scores[0].points == 0, scores[0].points
+
+
+def test_select_update_only_looks_up_cached_pks():
+    kept = Score.insert_many([dict(player='r%d' % i, points=i)
+                              for i in range(5)])[2]
+    Score._orm_obj_cache.clear()
+    Score._orm_remember(kept)
+    with recording() as executions:
+        Score.find(Score.player.like('r%')).update(points=7)
+    assert executions[0].startswith('select'), executions
+    assert executions[0].count('?') == 2, executions
+    assert kept.points == 7, kept.points
+
+
+def test_select_update_rejects_primary_key():
+    assert_raises(TypeError, Score.find().update, pk=1)
@@ -0,0 +1,54 @@
+from orm import connection
+from orm.model import *
+from orm.profile import Profiler, normalize
+
+
+class Widget(Model):
+    _orm_table = 'widget'
+    name = Column()
+
+
+def setup():
+    connection.connect(':memory:')
+    connection.cursor().execute('create table widget (name text)')
+    Widget.insert_many([dict(name='a'), dict(name='b'), dict(name='c')])
+
+
+def teardown():
+    connection.close()
+
+
+def test_cursor_is_unwrapped_without_hooks():
+    assert not isinstance(connection.cursor(), connection.profiling_cursor)
+
+
+def test_hooks_receive_executions():
+    calls = []
+    hook = connection.on_execute(lambda *args: calls.append(args))
+    try:
+        list(Widget.find())
+    finally:
+        connection.remove_hook(hook)
+    sql, args, elapsed = calls[0]
+    assert sql.startswith('select'), sql
+    assert elapsed >= 0, elapsed
+
+
+def test_normalize_collapses_literals_and_lists():
+    sql = normalize("select * from t where a in (?, ?, ?) limit 10  offset 5")
+    assert sql == 'select * from t where a in (?, ...) limit ? offset ?', sql
+
+
+def test_profiler_records_statements():
+    with Profiler() as profiler:
+        for i in range(3):
+            list(Widget.find())
+        Widget.find().exists()
+    stmt = profiler.statements[
+        'select "widget"."name", "widget"."rowid" from widget']
+    assert stmt.count == 3, stmt.count
+    assert stmt.rows == 9, stmt.rows
+    assert stmt.p99 >= 0, stmt.p99
+    assert stmt.site.startswith(__file__.rstrip('c')), stmt.site
+    assert 'select' in profiler.report()
+    assert not isinstance(connection.cursor(), connection.profiling_cursor)
@@ -186,3 +186,46 @@ def test_modellist():
         fake_model('table3')])
     assert e.sql() == 'table1, table2, table3', e.sql()
     assert e.args() == [], e.args()
+
+
+def test_statement_cache_compiles_sql_and_args():
+    cache = StatementCache()
+    sql, args = cache.compile(Select(Sql('1'), Sql('t'), Eq(Sql('a'), 1)))
+    assert sql == 'select 1 from t where a = ?', sql
+    assert args == [1], args
+    assert cache.misses == 1, cache.misses
+
+
+def test_statement_cache_reuses_sql_for_same_expression():
+    cache = StatementCache()
+    s = Select(Sql('1'), Sql('t'), Eq(Sql('a'), 1))
+    cache.compile(s)
+    sql, args = cache.compile(s)
+    assert sql == 'select 1 from t where a = ?', sql
+    assert args == [1], args
+    assert cache.hits == 1, cache.hits
+
+
+def test_statement_cache_compiles_each_expression_once():
+    class counting(Sql):
+        calls = 0
+        def sql(self):
+            counting.calls += 1
+            return super(counting, self).sql()
+    cache = StatementCache()
+    e = counting('blah')
+    for i in range(3):
+        assert cache.compile(e) == ('blah', []), cache.compile(e)
+    assert counting.calls == 1, counting.calls
+    assert cache.compile(Eq(Sql('a'), None)) == ('a isnull', [])
+
+
+def test_in_with_list():
+    e = In(Sql('a'), [1, 2, 3])
+    assert e.sql() == 'a in (?, ?, ?)', e.sql()
+    assert e.args() == [1, 2, 3], e.args()
+
+
+def test_and_parenthesises_or_operands():
+    e = And(Or(Sql('a'), Sql('b')), Sql('c'))
+    assert e.sql() == '(a or b) and c', e.sql()
@@ -181,3 +181,57 @@ def test_delete():
 
 def test_delete_without_sources_raises_typeerror():
     assert_raises(TypeError, Select(Sql(1)).delete)
+
+
+def test_negative_indexing_flips_order():
+    connection.connection = FakeConnection()
+    result = Select(Sql('1'), order=ExprList([Sql('a'), Desc(Sql('b'))]))[-1]
+    assert result == (1,), result
+    execution = connection.connection.cursors[0].executions[0]
+    assert execution == ('select 1 order by a desc, b limit 0, 1', []), \
+        execution
+
+
+def test_negative_slicing_reverses_results():
+    connection.connection = FakeConnection(((3,), (2,), (1,)))
+    s = Select(Sql('1'), order=Sql('a'))[-3:]
+    assert s.sql() == 'select 1 order by a desc limit 0, 3', s.sql()
+    assert list(s) == [(1,), (2,), (3,)], list(s)
+
+
+def test_negative_indexing_without_order_raises_notimplementederror():
+    assert_raises(NotImplementedError, lambda: Select(Sql('1'))[-1])
+
+
+def test_aggregate_sql():
+    e = Alias(Sum(Sql('a'), distinct=True), 'total')
+    assert e.sql() == 'sum(distinct a) as "total"', e.sql()
+    assert Count().sql() == 'count(*)', Count().sql()
+
+
+def test_group_by_and_having():
+    s = Select(Sql('1'), Sql('t')).group_by(Sql('a')).annotate(
+        n=Count()).having(Gt(Count(), 2))
+    assert s.sql() == (
+        'select a, count(*) as "n" from t group by a having count(*) > ?'
+    ), s.sql()
+    assert s.args() == [2], s.args()
+
+
+def test_grouped_len_counts_groups():
+    connection.connection = FakeConnection()
+    len(Select(Sql('1'), Sql('t')).group_by(Sql('a')))
+    execution = connection.connection.cursors[0].executions[0]
+    assert execution == (
+        'select count(*) from (select a from t group by a)', []), execution
+
+
+def test_annotate_without_group_by_raises_typeerror():
+    assert_raises(TypeError, Select(Sql('1')).annotate, n=Count())
+
+
+def test_result_cache_tracks_subquery_tables():
+    from orm.query import _tables
+    s = Select(sources=Sql('a'),
+               where=In(Sql('a.x'), Select(Sql('y'), Sql('"B"'))))
+    assert _tables(s) == frozenset(['a', 'b']), _tables(s)
@@ -0,0 +1,124 @@
+from nose.tools import assert_raises
+
+from orm import connection
+from orm.model import *
+from orm.session import Session
+
+from helpers import recording
+
+
+class Author(Model):
+    _orm_table = 'author'
+    name = Column()
+
+
+class Book(Model):
+    _orm_table = 'book'
+    title = Column()
+    author_id = Column('author')
+    author = ToOne(author_id, 'Author.pk')
+
+
+def setup():
+    connection.connect(':memory:')
+    connection.cursor().execute('create table author (name text)')
+    connection.cursor().execute('create table book (title text, author int)')
+
+
+def teardown():
+    connection.close()
+
+
+def test_flush_inserts_parents_before_children():
+    session = Session()
+    author = Author()
+    author.name = 'a'
+    for i in range(3):
+        book = Book()
+        book.title = str(i)
+        book.author = author
+        session.add(book)
+    session.add(author)
+    with recording() as executions:
+        session.commit()
+    executions = [sql for sql in executions if not sql.startswith('select')]
+    assert len(executions) == 2, executions
+    assert executions[0].startswith('insert into author'), executions
+    books = list(Book.find(Book.author_id == author.pk))
+    assert len(books) == 3, books
+
+
+def test_flush_groups_updates_and_deletes():
+    authors = Author.insert_many([dict(name=str(i)) for i in range(4)])
+    session = Session()
+    session.add_all(authors)
+    for author in authors[:3]:
+        author.name += '!'
+    session.delete(authors[3])
+    assert len(session.dirty) == 3, session.dirty
+    with recording() as executions:
+        session.flush()
+    assert len(executions) == 2, executions
+    assert not authors[0]._orm_dirty_attrs
+    assert Author.get(authors[0].pk).name == '0!'
+    assert authors[3]._orm_new_row
+
+
+def test_context_manager_rolls_back_on_error():
+    def fail():
+        with Session() as session:
+            author = Author()
+            author.name = 'rolled back'
+            session.add(author)
+            session.flush()
+            raise ValueError()
+    assert_raises(ValueError, fail)
+    assert not Author.find(Author.name == 'rolled back').exists()
+
+
+def test_flush_runs_in_one_transaction_in_autocommit_mode():
+    conn = connection._current()
+    level, conn.isolation_level = conn.isolation_level, None
+    try:
+        session = Session()
+        author = Author()
+        author.name = 'half flushed'
+        book = Book()
+        book.title, book.author = object(), author
+        session.add_all([author, book])
+        assert_raises(Exception, session.flush)
+        session.rollback()
+    finally:
+        conn.isolation_level = level
+    assert not Author.find(Author.name == 'half flushed').exists()
+
+
+def test_add_rejects_non_models():
+    assert_raises(TypeError, Session().add, object())
+
+
+def test_rollback_restores_flushed_objects():
+    session = Session()
+    author = Author()
+    author.name = 'rolled back'
+    session.add(author)
+    session.flush()
+    pk = author.pk
+    session.rollback()
+    assert author._orm_new_row
+    assert 'name' in author._orm_dirty_attrs
+    assert_raises(KeyError, Author.get, pk)
+
+
+def test_exception_inside_transaction_propagates():
+    author = Author()
+    author.name = 'scoped'
+    def fail():
+        with connection.transaction():
+            with Session() as session:
+                session.add(author)
+                session.flush()
+                raise ValueError('original')
+    assert_raises(ValueError, fail)
+    assert author._orm_new_row
+    assert not len(Author.find(Author.name == 'scoped'))
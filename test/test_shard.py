@@ -0,0 +1,166 @@
+import os
+import tempfile
+
+from nose.tools import assert_raises
+
+from orm import connection
+from orm.model import *
+from orm.query import Desc
+from orm.shard import ShardRouter
+
+
+class Account(Model):
+    _orm_table = 'account'
+    id = Column(primary=True, type='integer')
+    name = Column()
+    region = Column()
+
+
+paths = []
+
+
+def setup():
+    global router
+    paths[:] = [tempfile.mktemp(suffix='.sqlite') for i in range(3)]
+    router = Account._orm_shards = ShardRouter(paths)
+    for index in range(3):
+        with router.using(index):
+            Account.create_table()
+    Account.insert_many(dict(id=i, name='a%02d' % i, region=i % 2)
+                        for i in range(1, 21))
+    router.commit()
+
+
+def teardown():
+    del Account._orm_shards
+    router.close()
+    for path in paths:
+        os.unlink(path)
+
+
+def count(index):
+    with router.using(index):
+        return connection.cursor().execute(
+            'select count(*) from account').fetchone()[0]
+
+
+def test_rows_are_spread_across_shards():
+    assert [count(i) for i in range(3)] == [6, 7, 7]
+
+
+def test_get_goes_to_one_shard():
+    Account._orm_obj_cache.clear()
+    assert Account.get(5).name == 'a05'
+    assert_raises(KeyError, Account.get, 99)
+
+
+def test_save_goes_to_one_shard():
+    account = Account.get(4)
+    account.name = 'renamed'
+    account.save()
+    with router.using(1):
+        assert connection.cursor().execute(
+            'select name from account where id = 4').fetchone()[0] == 'renamed'
+    account.name = 'a04'
+    account.save()
+    router.commit()
+
+
+def test_find_merges_in_order():
+    names = [a.name for a in Account.find().order_by(Desc(Account.name))]
+    assert names == ['a%02d' % i for i in range(20, 0, -1)], names
+    ids = [a.id for a in Account.find(Account.region == 0)
+           .order_by(Account.id)[2:5]]
+    assert ids == [6, 8, 10], ids
+
+
+def test_len_and_exists_fan_out():
+    assert len(Account.find()) == 20
+    assert len(Account.find(Account.region == 1)[3:]) == 7
+    assert Account.find(Account.id == 17).exists()
+    assert not Account.find(Account.id == 99).exists()
+
+
+def test_update_fans_out():
+    account = Account.get(3)
+    assert Account.find(Account.region == 1).update(region=3) == 10
+    assert account.region == 3, account.region
+    assert len(Account.find(Account.region == 3)) == 10
+    Account.find(Account.region == 3).update(region=1)
+    router.commit()
+
+
+def test_moving_shard_key_raises():
+    class Tenant(Model):
+        _orm_table = 'account'
+        id = Column(primary=True, type='integer')
+        name = Column()
+        region = Column()
+    Tenant._orm_shards = ShardRouter(paths[:2], key='region')
+    try:
+        with Tenant._orm_shards.using(1):
+            tenant = Tenant.find(Tenant.region == 1)[0]
+        tenant.region = 2
+        assert_raises(ValueError, tenant.save)
+        tenant.region = 3
+        tenant.name = 'moved'
+        tenant.save()
+        Tenant._orm_shards.rollback()
+    finally:
+        Tenant._orm_shards.close()
+
+
+def test_commit_reaches_shards():
+    account = Account.get(7)
+    account.name = 'async'
+    account.asave().result()
+    with router.using(1):
+        assert connection.cursor().execute(
+            'select name from account where id = 7').fetchone()[0] == 'async'
+    account.name = 'a07'
+    account.save()
+    connection.commit()
+    router.release()
+    other = ShardRouter([paths[1]])
+    try:
+        with other.using(0):
+            assert connection.cursor().execute(
+                'select name from account where id = 7').fetchone()[0] == \
+                'a07'
+    finally:
+        other.close()
+
+
+def test_afetch_runs_inline_on_worker():
+    ids = sorted(a.id for a in Account.find().afetch().result(5))
+    assert ids == range(1, 21), ids
+
+
+def test_session_routes_to_shards():
+    from orm.session import Session
+    account = Account.get(8)
+    with Session() as session:
+        account.name = 'session'
+        session.add(account)
+    with router.using(2):
+        assert connection.cursor().execute(
+            'select name from account where id = 8').fetchone()[0] == \
+            'session'
+    account.name = 'a08'
+    account.save()
+    router.commit()
+
+
+def test_child_collections_use_the_shards():
+    class Owner(Model):
+        _orm_table = 'account'
+        id = Column(primary=True, type='integer')
+        name = Column()
+        region = Column()
+    Owner.accounts = ToMany(Owner.region, Account.region)
+    owner = Owner.__new__(Owner)
+    owner.region = 1
+    assert len(owner.accounts) == 10
+    assert sorted(a.id for a in owner.accounts) == range(1, 21, 2)
+    assert [a.id for a in owner.accounts.order_by(Account.id)[:2]] == [1, 3]
+    assert owner.accounts.find(Account.id == 5).exists()
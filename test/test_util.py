@@ -34,3 +34,28 @@ def test_slice2limit_step_raises_typeerror():
 def test_slice2limit_negative_values_raise_notimplementederror():
     assert_raises(NotImplementedError, util.slice2limit, slice(-1))
     assert_raises(NotImplementedError, util.slice2limit, slice(-1, None))
+
+
+def test_reverse_slice_tail():
+    slc = util.reverse_slice(slice(-20, None))
+    assert slc == slice(0, 20), slc
+
+
+def test_reverse_slice_negative_bounds():
+    slc = util.reverse_slice(slice(-20, -5))
+    assert slc == slice(5, 20), slc
+
+
+def test_reverse_slice_all_but_last():
+    slc = util.reverse_slice(slice(None, -5))
+    assert slc == slice(5, None), slc
+
+
+def test_reverse_slice_empty():
+    slc = util.reverse_slice(slice(-5, -10))
+    assert slc == slice(10, 10), slc
+
+
+def test_reverse_slice_mixed_raises_notimplementederror():
+    assert_raises(NotImplementedError, util.reverse_slice, slice(1, -1))
+    assert_raises(NotImplementedError, util.reverse_slice, slice(-1, 1))